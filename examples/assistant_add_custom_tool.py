@@ -16,15 +16,14 @@
 
 import json
 import os
-import urllib.parse
-
-import json5
+from urllib.parse import quote_from_bytes
 
 from qwen_agent.agents import Assistant
 from qwen_agent.gui import WebUI
 from qwen_agent.tools.base import BaseTool, register_tool
 
 ROOT_RESOURCE = os.path.join(os.path.dirname(__file__), 'resource')
+IMAGE_GEN_BASE_URL = 'https://image.pollinations.ai/prompt/'
 
 
 # Add a custom tool named my_image_gen：
@@ -39,10 +38,10 @@ class MyImageGen(BaseTool):
     }]
 
     def call(self, params: str, **kwargs) -> str:
-        prompt = json5.loads(params)['prompt']
-        prompt = urllib.parse.quote(prompt)
+        prompt = self._verify_json_format_args(params)['prompt']
+        prompt = quote_from_bytes(prompt.encode('utf-8'), safe='')
         return json.dumps(
-            {'image_url': f'https://image.pollinations.ai/prompt/{prompt}'},
+            {'image_url': IMAGE_GEN_BASE_URL + prompt},
             ensure_ascii=False,
         )
 
@@ -13,6 +13,9 @@
 # limitations under the License.
 
 import os
+import threading
+import time
+from collections import OrderedDict
 from typing import Dict, Optional, Union
 
 import requests
@@ -43,28 +46,51 @@ class AmapWeather(BaseTool):
         import pandas as pd
         self.city_df = pd.read_excel(
             'https://modelscope.oss-cn-beijing.aliyuncs.com/resource/agent/AMap_adcode_citycode.xlsx')
+        self._adcode_map = None
 
         self.token = self.cfg.get('token', os.environ.get('AMAP_TOKEN', ''))
         assert self.token != '', 'weather api token must be acquired through ' \
             'https://lbs.amap.com/api/webservice/guide/create-project/get-key and set by AMAP_TOKEN'
 
+        # Opt-in: successful lookups are reused for `cache_ttl` seconds (0, the default, disables the cache)
+        self.cache_ttl = self.cfg.get('cache_ttl', 0)
+        self.cache_size = self.cfg.get('cache_size', 256)
+        self._weather_cache = OrderedDict()
+        # The same tool instance is shared by agents running in worker threads
+        self._cache_lock = threading.Lock()
+
     def get_city_adcode(self, city_name):
-        filtered_df = self.city_df[self.city_df['中文名'] == city_name]
-        if len(filtered_df['adcode'].values) == 0:
+        if self._adcode_map is None:
+            # Build the name -> adcode index once instead of scanning the table on every call
+            unique_df = self.city_df.drop_duplicates('中文名')
+            self._adcode_map = dict(zip(unique_df['中文名'], unique_df['adcode']))
+        adcode = self._adcode_map.get(city_name)
+        if adcode is None:
             _c = self.city_df['中文名']
             raise ValueError(f'location {city_name} not found, availables are {_c}')
-        else:
-            return filtered_df['adcode'].values[0]
+        return adcode
 
     def call(self, params: Union[str, dict], **kwargs) -> str:
         params = self._verify_json_format_args(params)
 
         location = params['location']
-        response = requests.get(self.url.format(city=self.get_city_adcode(location), key=self.token))
-        data = response.json()
-        if data['status'] == '0':
-            raise RuntimeError(data)
+        adcode = self.get_city_adcode(location)
+        with self._cache_lock:
+            cached = self._weather_cache.get(adcode)
+        if cached is not None and time.monotonic() - cached[0] < self.cache_ttl:
+            weather, temperature = cached[1]
         else:
+            response = requests.get(self.url.format(city=adcode, key=self.token))
+            data = response.json()
+            if data['status'] == '0':
+                raise RuntimeError(data)
             weather = data['lives'][0]['weather']
             temperature = data['lives'][0]['temperature']
-            return f'{location}的天气是{weather}温度是{temperature}度。'
+            if self.cache_ttl > 0:
+                # Keep entries oldest-first, and evict the oldest entry when full
+                with self._cache_lock:
+                    self._weather_cache[adcode] = (time.monotonic(), (weather, temperature))
+                    self._weather_cache.move_to_end(adcode)
+                    if len(self._weather_cache) > self.cache_size:
+                        self._weather_cache.popitem(last=False)
+        return f'{location}的天气是{weather}温度是{temperature}度。'
@@ -0,0 +1,105 @@
+"""
+聊天服务器WebSocket处理测试
+"""
+
+import asyncio
+import json
+
+import pytest
+from fastapi import WebSocketDisconnect
+
+from qwen_agent.llm.schema import ASSISTANT, Message
+
+_LLM_CFG = {'model': 'qwen-max', 'model_server': 'dashscope', 'api_key': 'x'}
+
+
+class FakeWebSocket:
+    """按顺序返回预置消息，最后模拟客户端断开"""
+
+    def __init__(self, incoming):
+        self.incoming = list(incoming)
+        self.sent = []
+
+    async def accept(self):
+        pass
+
+    async def receive_text(self):
+        if not self.incoming:
+            raise WebSocketDisconnect()
+        return self.incoming.pop(0)
+
+    async def send_text(self, data):
+        self.sent.append(json.loads(data))
+
+
+@pytest.fixture
+def chat_server(tmp_path, monkeypatch):
+    # 模块导入时会在当前目录创建全局记忆数据库，切换到临时目录后再导入
+    monkeypatch.chdir(tmp_path)
+    from ty_mem_agent.server import chat_server
+    return chat_server
+
+
+def test_websocket_full_turn(chat_server, monkeypatch):
+    from ty_mem_agent.agents.ty_memory_agent import TYMemoryAgent
+    from ty_mem_agent.memory.user_memory import integrated_memory
+    from ty_mem_agent.server.user_manager import User
+
+    memory_calls = []
+    saved = []
+
+    async def get_user_context(user_id, session_id, query=''):
+        memory_calls.append((user_id, session_id))
+        return {'user_profile': {'location': '北京'}}
+
+    async def save_conversation(user_id, session_id, message, response, context=None, preferences=None):
+        saved.append((user_id, session_id, message, response))
+        return True
+
+    monkeypatch.setattr(integrated_memory, 'get_user_context', get_user_context)
+    monkeypatch.setattr(integrated_memory, 'save_conversation', save_conversation)
+
+    agents = []
+
+    def make_agent():
+        agent = TYMemoryAgent(function_list=[], llm=_LLM_CFG)
+
+        def fake_run(messages, lang='zh', **kwargs):
+            yield [Message(role=ASSISTANT, content='你好')]
+            yield [Message(role=ASSISTANT, content='你好，北京今天晴')]
+
+        agent._run = fake_run
+        agents.append(agent)
+        return agent
+
+    monkeypatch.setattr(chat_server, 'TYMemoryAgent', make_agent)
+    monkeypatch.setattr(chat_server.user_manager, 'get_user_session', lambda user_id: None)
+
+    server = chat_server.ChatServer()
+    user = User(user_id='u1', username='tester')
+    websocket = FakeWebSocket([json.dumps({'content': '今天天气怎么样'})])
+
+    asyncio.run(server._handle_websocket_connection(websocket, user))
+
+    types = [m['type'] for m in websocket.sent]
+    assert 'error' not in types
+    assert types == ['message', 'status', 'message', 'message', 'status']
+    assert websocket.sent[-2]['content'] == '你好，北京今天晴'
+    assert websocket.sent[-1]['content'] == '完成'
+
+    # 记忆读取和写入使用同一个会话ID，断开时等待写入完成并释放Agent
+    session_id = memory_calls[-1][1]
+    assert session_id.startswith('ws_')
+    assert saved == [('u1', session_id, '今天天气怎么样', '你好，北京今天晴')]
+    assert server.user_agents == {} and server.active_connections == {}
+    assert len(agents) == 1 and agents[0]._writer_task is None
+
+
+def test_stop_before_start_skips_serving(chat_server):
+    server = chat_server.ChatServer()
+
+    # 服务器创建前收到退出请求时，start_server直接返回而不是一直运行
+    server.stop_server()
+    asyncio.run(asyncio.wait_for(server.start_server(), timeout=5))
+
+    assert server._uvicorn_server is None
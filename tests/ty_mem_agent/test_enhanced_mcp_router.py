@@ -0,0 +1,225 @@
+"""
+增强版MCP路由器测试
+"""
+
+import asyncio
+
+import pytest
+
+from qwen_agent.llm.schema import ASSISTANT, Message
+from ty_mem_agent.mcp.enhanced_mcp_router import (EnhancedMCPRouter, LLMIntentAnalyzer, MCPRequest, MCPResponse,
+                                                  MCPService, _extract_json_block, _json_block_closed)
+
+_TEST_LLM_CFG = {'model': 'qwen-max', 'model_server': 'dashscope', 'api_key': 'test'}
+
+
+class StubService(MCPService):
+    """记录调用顺序的测试服务"""
+
+    def __init__(self, name, events, delay=0.0, error=None):
+        super().__init__(name, f'{name} service', [], [])
+        self.events = events
+        self.delay = delay
+        self.error = error
+        self.received = None
+
+    async def can_handle(self, request):
+        return 1.0
+
+    async def execute(self, request):
+        self.received = request
+        self.events.append(('start', self.name))
+        await asyncio.sleep(self.delay)
+        self.events.append(('end', self.name))
+        if self.error:
+            raise self.error
+        return MCPResponse(service_name=self.name, success=True, result=f'{self.name}-ok',
+                           reasoning_steps=[f'{self.name}执行'])
+
+
+class StubAnalyzer:
+    """返回固定分析结果的意图分析器"""
+
+    def __init__(self, analysis):
+        self.analysis = analysis
+
+    async def analyze_intent(self, text, available_services, context=None):
+        return self.analysis
+
+
+class StubLLM:
+    """流式返回固定JSON并记录调用次数的LLM"""
+
+    def __init__(self, content):
+        self.content = content
+        self.calls = 0
+
+    def chat(self, messages, stream=True, extra_generate_cfg=None):
+        self.calls += 1
+        yield [Message(role=ASSISTANT, content=self.content)]
+
+
+def _make_router(services, analysis):
+    router = EnhancedMCPRouter(llm=_TEST_LLM_CFG)
+    for service in services:
+        router.register_service(service)
+    router.intent_analyzer = StubAnalyzer(analysis)
+    return router
+
+
+def _route(router):
+    request = MCPRequest(user_id='u', session_id='s', intent='test', parameters={'shared': 1}, context={})
+    return asyncio.run(router.route_request(request))
+
+
+@pytest.mark.parametrize('content, expected', [
+    # ```json代码块
+    ('分析如下：\n```json\n{"primary_intent": "weather"}\n```', '{"primary_intent": "weather"}'),
+    # 没有代码块，直接输出对象
+    ('{"a": 1}', '{"a": 1}'),
+    # 对象后面带多余文字
+    ('好的 {"a": {"b": [1, 2]}} 以上是分析结果', '{"a": {"b": [1, 2]}}'),
+    # 代码块前的说明文字中有花括号时，从代码块之后开始查找
+    ('示例 {x}\n```json\n{"a": 1}\n```', '{"a": 1}'),
+    # 字符串中的花括号不计入层级
+    ('```json\n{"text": "}{", "n": {"m": "{"}}\n```', '{"text": "}{", "n": {"m": "{"}}'),
+    # 转义的引号不会结束字符串
+    ('{"text": "他说\\"}\\"", "ok": true} 尾随', '{"text": "他说\\"}\\"", "ok": true}'),
+    # 转义的反斜杠后的引号会结束字符串
+    ('{"path": "C:\\\\"} 尾随', '{"path": "C:\\\\"}'),
+    # 不完整或没有对象
+    ('```json\n{"a": {"b": 1}\n```', None),
+    ('{"text": "}', None),
+    ('没有JSON', None),
+    ('', None),
+])
+def test_extract_json_block(content, expected):
+    assert _extract_json_block(content) == expected
+
+
+@pytest.mark.parametrize('content, expected', [
+    ('```json\n{"a": 1}', True),
+    ('```json\n{"a": {', False),
+    ('  {"a": 1}', True),
+    # 没有代码块且不以"{"开头时不提前结束
+    ('说明 {x} 继续', False),
+])
+def test_json_block_closed(content, expected):
+    assert _json_block_closed(content) is expected
+
+
+def test_plan_layers_respects_dependencies():
+    layers = EnhancedMCPRouter._plan_layers(['a', 'b', 'c', 'd'], {'c': ['a'], 'd': ['c', 'b']})
+    assert layers == [['a', 'b'], ['c'], ['d']]
+
+
+def test_plan_layers_ignores_unknown_and_self_dependencies():
+    layers = EnhancedMCPRouter._plan_layers(['b', 'a'], {'a': ['a', 'missing']})
+    assert layers == [['b', 'a']]
+
+
+def test_plan_layers_falls_back_to_sequential_on_cycle():
+    layers = EnhancedMCPRouter._plan_layers(['a', 'b', 'c'], {'a': ['b'], 'b': ['a']})
+    assert layers == [['a'], ['b'], ['c']]
+
+
+def test_route_runs_independent_services_concurrently():
+    events = []
+    a, b, c = (StubService(name, events, delay=0.05) for name in 'abc')
+    router = _make_router([a, b, c], {
+        'required_services': ['a', 'b', 'c'],
+        'dependencies': {'c': ['a', 'b']},
+        'parameters': {'a': {'x': 1}},
+        'reasoning': ['分析'],
+    })
+
+    response = _route(router)
+
+    # a、b同时开始，都结束后才开始c
+    assert events[:2] == [('start', 'a'), ('start', 'b')]
+    assert events[4:] == [('start', 'c'), ('end', 'c')]
+    assert response.success
+    assert response.service_name == 'a,b,c'
+    assert response.result == {'a': 'a-ok', 'b': 'b-ok', 'c': 'c-ok'}
+    assert response.reasoning_steps == ['分析', 'a执行', 'b执行', 'c执行']
+    # 每个服务使用各自的请求副本，下游服务收到上游服务的结果
+    assert a.received.parameters == {'shared': 1, 'x': 1}
+    assert b.received.parameters == {'shared': 1}
+    assert c.received.parameters == {'shared': 1, 'upstream_results': {'a': 'a-ok', 'b': 'b-ok'}}
+
+
+def test_route_cycle_runs_services_one_by_one():
+    events = []
+    a, b = (StubService(name, events) for name in 'ab')
+    router = _make_router([a, b], {'required_services': ['a', 'b'], 'dependencies': {'a': ['b'], 'b': ['a']}})
+
+    response = _route(router)
+
+    assert events == [('start', 'a'), ('end', 'a'), ('start', 'b'), ('end', 'b')]
+    assert response.success
+    # 顺序执行时只传已经执行过的上游服务结果
+    assert 'upstream_results' not in a.received.parameters
+    assert b.received.parameters['upstream_results'] == {'a': 'a-ok'}
+
+
+def test_route_aggregates_failures():
+    events = []
+    ok = StubService('ok', events)
+    bad = StubService('bad', events, error=RuntimeError('boom'))
+    router = _make_router([ok, bad], {'required_services': ['ok', 'bad']})
+
+    response = _route(router)
+
+    assert not response.success
+    assert response.result == {'ok': 'ok-ok', 'bad': None}
+    assert 'bad: 服务执行错误: boom' in response.error
+    assert isinstance(response.metadata['responses']['bad'], MCPResponse)
+    stats = router.get_service_stats()
+    assert stats['ok']['successful_requests'] == 1
+    assert stats['bad']['total_requests'] == 1 and stats['bad']['successful_requests'] == 0
+
+
+def test_route_single_service_keeps_plain_response():
+    events = []
+    a = StubService('a', events)
+    router = _make_router([a], {'required_services': ['missing', 'a']})
+
+    response = _route(router)
+
+    assert response.service_name == 'a'
+    assert response.result == 'a-ok'
+
+
+def test_route_times_each_service_call():
+    events = []
+    slow = StubService('slow', events, delay=0.1)
+    fast = StubService('fast', events)
+    router = _make_router([slow, fast], {'required_services': ['slow', 'fast'],
+                                         'dependencies': {'fast': ['slow']}})
+
+    response = _route(router)
+
+    # 下游服务的耗时不包含等待上游服务的时间
+    stats = router.get_service_stats()
+    assert stats['slow']['average_response_time'] >= 0.1
+    assert stats['fast']['average_response_time'] < 0.05
+    assert response.execution_time >= 0.1
+
+
+def test_analyzer_cache_returns_independent_copies():
+    llm = StubLLM('{"primary_intent": "weather", "required_services": ["a"], "parameters": {"a": {"city": "北京"}}}')
+    analyzer = LLMIntentAnalyzer(llm)
+    services = [StubService('a', [])]
+
+    first = asyncio.run(analyzer.analyze_intent('天气', services))
+    first['parameters']['a']['city'] = '上海'
+    second = asyncio.run(analyzer.analyze_intent('天气', services))
+
+    # 命中缓存不再调用LLM，且调用方修改返回结果不影响缓存
+    assert llm.calls == 1
+    assert second['parameters'] == {'a': {'city': '北京'}}
+    assert second is not first
+
+    # 服务集合变化时不命中旧结果
+    asyncio.run(analyzer.analyze_intent('天气', services + [StubService('b', [])]))
+    assert llm.calls == 2
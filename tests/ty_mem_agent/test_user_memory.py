@@ -0,0 +1,71 @@
+"""
+用户记忆管理测试
+"""
+
+import sqlite3
+
+import pytest
+
+
+@pytest.fixture
+def user_memory(tmp_path, monkeypatch):
+    # 模块导入时会在当前目录创建全局记忆数据库，切换到临时目录后再导入
+    monkeypatch.chdir(tmp_path)
+    from ty_mem_agent.memory import user_memory
+    return user_memory
+
+
+@pytest.fixture
+def manager(user_memory, tmp_path):
+    return user_memory.UserMemoryManager(db_path=str(tmp_path / 'test_memory.db'))
+
+
+def _save_history(user_memory, manager, turns):
+    history = [{'message': f'问题{i}', 'response': f'回答{i}', 'timestamp': f'2024-01-01T00:00:{i:02d}'}
+               for i in range(turns)]
+    context = user_memory.ConversationContext(user_id='u', session_id='s', current_topic='天气',
+                                              conversation_history=history)
+    assert manager.save_conversation_context(context)
+    return history
+
+
+@pytest.mark.parametrize('turns, limit', [(12, 5), (3, 5), (5, 5), (0, 5), (8, 1)])
+def test_history_limit_keeps_newest_in_order(user_memory, manager, turns, limit):
+    history = _save_history(user_memory, manager, turns)
+
+    context = manager.get_conversation_context('s', history_limit=limit)
+
+    # 与按Python切片 history[-limit:] 的结果一致：最近N条，按时间正序
+    assert context.conversation_history == history[-limit:]
+    assert context.current_topic == '天气'
+    assert context.user_id == 'u'
+
+
+def test_history_without_limit_returns_all(user_memory, manager):
+    history = _save_history(user_memory, manager, 7)
+
+    assert manager.get_conversation_context('s').conversation_history == history
+
+
+def test_history_limit_without_json1(user_memory, manager):
+    history = _save_history(user_memory, manager, 9)
+
+    class NoJson1Connection:
+        """模拟未启用JSON1扩展的SQLite"""
+
+        def __init__(self, conn):
+            self.conn = conn
+
+        def execute(self, sql, params=()):
+            if 'json_each' in sql:
+                raise sqlite3.OperationalError('no such table: json_each')
+            return self.conn.execute(sql, params)
+
+    with sqlite3.connect(manager.db_path) as conn:
+        context = manager._query_conversation_context(NoJson1Connection(conn), 's', 5)
+
+    assert context.conversation_history == history[-5:]
+
+
+def test_missing_session_returns_none(manager):
+    assert manager.get_conversation_context('missing', history_limit=5) is None
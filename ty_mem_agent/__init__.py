@@ -16,15 +16,22 @@ __version__ = "1.0.0"
 __author__ = "TY Memory Agent Team"
 __description__ = "智能记忆助手系统"
 
-# 统一导入策略 - 使用绝对导入
-from .agents.ty_memory_agent import TYMemoryAgent
-from .server.chat_server import ChatServer
-from .server.user_manager import UserManager
-from .config.settings import settings
-from .memory.memos_client import memory_manager
-from .memory.user_memory import integrated_memory
-from .mcp.enhanced_mcp_router import get_enhanced_router
-from .utils.logger_config import setup_logger, get_logger
+import importlib
+import os
+
+# 统一导入策略 - 按需导入（PEP 562），访问属性时才加载对应子模块，
+# 避免只用到某个子模块时也加载服务器、记忆系统和Agent的全部依赖
+_LAZY_IMPORTS = {
+    'TYMemoryAgent': '.agents.ty_memory_agent',
+    'ChatServer': '.server.chat_server',
+    'UserManager': '.server.user_manager',
+    'settings': '.config.settings',
+    'memory_manager': '.memory.memos_client',
+    'integrated_memory': '.memory.user_memory',
+    'get_enhanced_router': '.mcp.enhanced_mcp_router',
+    'setup_logger': '.utils.logger_config',
+    'get_logger': '.utils.logger_config',
+}
 
 __all__ = [
     'TYMemoryAgent',
@@ -36,4 +43,23 @@ __all__ = [
     'get_enhanced_router',
     'setup_logger',
     'get_logger'
-]
\ No newline at end of file
+]
+
+
+def __getattr__(name):
+    module_name = _LAZY_IMPORTS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module_name, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
+
+
+# TY_EAGER_IMPORT=1 时立即导入全部子模块，便于发现延迟导入引入的问题
+if os.getenv("TY_EAGER_IMPORT") == "1":
+    for _name in __all__:
+        __getattr__(_name)
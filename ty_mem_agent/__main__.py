@@ -0,0 +1,14 @@
+#!/usr/bin/env python3
+"""
+TY Memory Agent 模块入口
+用法: python -m ty_mem_agent
+"""
+
+import asyncio
+import sys
+
+from ty_mem_agent.main import main
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -3,6 +3,6 @@
 TY Memory Agent 代理模块
 """
 
-from .ty_memory_agent import TYMemoryAgent
+from .ty_memory_agent import TYMemoryAgent, warmup_default_llm, warmup_default_tools
 
-__all__ = ['TYMemoryAgent']
+__all__ = ['TYMemoryAgent', 'warmup_default_llm', 'warmup_default_tools']
@@ -4,31 +4,220 @@ TY Memory Agent - 基于QwenAgent的智能记忆代理
 直接集成QwenAgent内置工具，简洁高效
 """
 
-import sys
-import os
-from pathlib import Path
-from typing import Dict, List, Optional, Any, Union
+import asyncio
+import functools
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Any, Tuple, Union
 from loguru import logger
 
-# 添加QwenAgent路径
-project_root = Path(__file__).parent.parent.parent
-sys.path.insert(0, str(project_root))
+if __name__ == "__main__":
+    # 直接运行本文件时添加项目根目录（作为包导入时已在路径中）
+    import sys
+    from pathlib import Path
+    sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
 
 try:
     from qwen_agent.agents.assistant import Assistant
-    from qwen_agent.llm import get_chat_model
-    from qwen_agent.tools.amap_weather import AmapWeather
+    from qwen_agent.llm.schema import ASSISTANT, SYSTEM, USER, ContentItem, Message
     from qwen_agent.tools.base import BaseTool
     logger.info("✅ 成功导入QwenAgent核心组件")
 except ImportError as e:
     logger.error(f"❌ 无法导入QwenAgent核心组件: {e}")
     raise
 
-# 本地导入
+# 本地导入（工具和记忆系统在首次使用时导入，记忆系统导入时会初始化数据库和HTTP客户端）
 from ty_mem_agent.config.settings import settings, get_llm_config
-from ty_mem_agent.memory.memos_client import memory_manager
-from ty_mem_agent.memory.user_memory import integrated_memory
-from ty_mem_agent.mcp.qwen_style_didi_service import QwenStyleDidiService
+
+# 默认系统消息和描述
+_DEFAULT_SYSTEM_MESSAGE = """你是一个智能记忆助手，具备以下能力：
+
+🧠 记忆能力：
+- 长期记忆：记住用户的基本信息、偏好、历史对话
+- 上下文记忆：理解当前对话的上下文
+- 多用户支持：为不同用户提供个性化服务
+
+🛠️ 工具能力：
+- 天气查询：使用amap_weather工具查询天气
+- 叫车服务：使用didi_ride工具预约车辆
+- 智能分析：基于用户记忆提供个性化建议
+
+💡 交互原则：
+- 主动利用用户记忆提供个性化服务
+- 根据用户历史偏好调整回复风格
+- 在适当时机调用工具满足用户需求
+- 保持友好、专业的对话风格
+
+请根据用户的需求和记忆信息，提供最合适的帮助。"""
+
+_DEFAULT_DESCRIPTION = ("智能记忆助手，具备长期记忆能力、多用户支持、"
+                        "智能工具调用等功能，可以叫车、查天气等")
+
+# 同步生成器耗尽标记
+_STREAM_END = object()
+
+# 记忆写入队列容量
+_MEMORY_QUEUE_SIZE = 1024
+
+# 记忆上下文缓存容量
+_CONTEXT_CACHE_SIZE = 64
+
+# 天气查询结果缓存时间（秒），同一城市短时间内重复查询不再请求高德API
+_WEATHER_CACHE_TTL = 600
+
+# 单条相关记忆的最大长度（UTF-8字节数，中文约150字）
+_MEMORY_TEXT_MAX_BYTES = 450
+
+# 注入提示词的用户画像字段（固定顺序）
+_PROFILE_FIELDS = (
+    ("name", "姓名"),
+    ("age", "年龄"),
+    ("gender", "性别"),
+    ("location", "位置"),
+    ("occupation", "职业"),
+    ("interests", "兴趣"),
+)
+
+# 默认工具只创建一次；锁保证预热线程与同步调用不会重复创建
+_default_tools_lock = threading.Lock()
+_default_llm_lock = threading.Lock()
+
+
+@functools.cache
+def _build_weather_tool() -> BaseTool:
+    """创建QwenAgent内置天气工具（创建失败时不缓存，下次调用重试）"""
+    from qwen_agent.tools.amap_weather import AmapWeather
+    
+    weather_cfg = {'cache_ttl': _WEATHER_CACHE_TTL}
+    if settings.AMAP_TOKEN:
+        weather_cfg['token'] = settings.AMAP_TOKEN
+    return AmapWeather(weather_cfg)
+
+
+@functools.cache
+def _build_didi_tool() -> BaseTool:
+    """创建自定义滴滴叫车工具（创建失败时不缓存，下次调用重试）"""
+    from ty_mem_agent.mcp.qwen_style_didi_service import QwenStyleDidiService
+    
+    return QwenStyleDidiService({'api_key': settings.DIDI_API_KEY} if settings.DIDI_API_KEY else None)
+
+
+def _build_default_tools() -> Tuple[BaseTool, ...]:
+    """创建默认工具 - 使用QwenAgent内置工具和自定义工具
+    
+    API密钥从settings读取后传给工具（.env中的配置不会进入os.environ），
+    未配置时工具自行回退到环境变量。每个工具单独缓存，
+    某个工具创建失败（如城市编码表下载失败）时只跳过本次，之后的调用会重新创建。
+    """
+    tools = []
+    
+    # 添加QwenAgent内置天气工具
+    try:
+        tools.append(_build_weather_tool())
+        logger.debug("✅ 添加QwenAgent内置天气工具")
+    except Exception as e:
+        logger.warning(f"⚠️ 无法添加天气工具: {e}")
+    
+    # 添加自定义滴滴叫车工具
+    try:
+        tools.append(_build_didi_tool())
+        logger.debug("✅ 添加滴滴叫车工具")
+    except Exception as e:
+        logger.warning(f"⚠️ 无法添加滴滴工具: {e}")
+    
+    return tuple(tools)
+
+
+def _load_default_tools() -> Tuple[BaseTool, ...]:
+    """获取默认工具（首次调用时创建）"""
+    with _default_tools_lock:
+        return _build_default_tools()
+
+
+@functools.cache
+def _build_default_llm() -> Any:
+    """创建默认LLM客户端（所有代理共用，避免每个用户连接各自创建）"""
+    from qwen_agent.llm import get_chat_model
+    return get_chat_model(get_llm_config())
+
+
+def _load_default_llm() -> Any:
+    """获取默认LLM客户端（首次调用时创建）"""
+    with _default_llm_lock:
+        return _build_default_llm()
+
+
+async def warmup_default_tools() -> None:
+    """预热默认工具（应用启动时调用）
+    
+    天气工具初始化需要下载城市编码表，放到线程池中执行，
+    之后每次创建代理只读取缓存，不再阻塞事件循环。
+    """
+    tools = await asyncio.to_thread(_load_default_tools)
+    logger.info(f"🔥 默认工具预热完成: {[tool.name for tool in tools]}")
+
+
+async def warmup_default_llm() -> None:
+    """预热默认LLM客户端（应用启动时调用，与工具预热并发执行）
+    
+    创建客户端时会导入模型服务SDK，放到线程池中执行，
+    避免首个连接创建代理时等待。
+    """
+    llm = await asyncio.to_thread(_load_default_llm)
+    logger.info(f"🔥 默认LLM预热完成: {getattr(llm, 'model', '')}")
+
+
+def _make_system_message(content: str, as_message: bool = False) -> Union[Dict, Message]:
+    """构造系统消息
+    
+    输入为Message对象时返回Message（内容由本模块生成，跳过pydantic校验），
+    否则返回dict，保持QwenAgent按输入类型决定输出类型的行为。
+    """
+    if as_message:
+        return Message.model_construct(role=SYSTEM, content=content)
+    return {"role": SYSTEM, "content": content}
+
+
+@functools.lru_cache(maxsize=1024)
+def _profile_system_message(profile_context: str, as_message: bool) -> Union[Dict, Message]:
+    """用户画像系统消息，画像不变时各轮对话复用同一个对象
+    
+    Agent.run会先深拷贝输入消息，共享的消息对象不会被修改。
+    """
+    return _make_system_message(f"用户信息：\n{profile_context}", as_message=as_message)
+
+
+@functools.lru_cache(maxsize=1024)
+def _render_profile(values: Tuple[Any, ...]) -> str:
+    """按_PROFILE_FIELDS的顺序渲染用户画像"""
+    profile_parts = []
+    for (_, label), value in zip(_PROFILE_FIELDS, values):
+        if not value:
+            continue
+        if isinstance(value, tuple):
+            value = ", ".join(str(item) for item in value)
+        profile_parts.append(f"{label}: {value}")
+    return "\n".join(profile_parts)
+
+
+def _truncate_memory_text(text: str) -> str:
+    """按UTF-8字节数截断记忆内容"""
+    text_bytes = text.encode("utf-8")
+    if len(text_bytes) <= _MEMORY_TEXT_MAX_BYTES:
+        return text
+    return text_bytes[:_MEMORY_TEXT_MAX_BYTES].decode("utf-8", "ignore") + "..."
+
+
+def _last_text_content(messages: List[Any], role: str) -> str:
+    """从后往前查找指定角色的最后一条文本消息内容"""
+    return next((msg.get("content") for msg in reversed(messages)
+                 if msg.get("role") == role and isinstance(msg.get("content"), str)), "")
+
+
+def _format_prompt(messages: List[Any]) -> str:
+    """格式化消息列表（仅用于调试日志）"""
+    return "\n".join(f"[{i}] {msg.get('role')}: {msg.get('content')}" for i, msg in enumerate(messages))
 
 
 class TYMemoryAgent(Assistant):
@@ -54,13 +243,11 @@ class TYMemoryAgent(Assistant):
             system_message = self._build_system_message()
         
         if not description:
-            description = ("智能记忆助手，具备长期记忆能力、多用户支持、"
-                          "智能工具调用等功能，可以叫车、查天气等")
+            description = _DEFAULT_DESCRIPTION
         
-        # 默认LLM配置
+        # 默认LLM配置（进程内共用同一个客户端）
         if llm is None:
-            llm_config = get_llm_config()
-            llm = get_chat_model(llm_config)
+            llm = _load_default_llm()
         
         # 默认工具列表 - 使用QwenAgent内置工具和自定义工具
         if function_list is None:
@@ -77,185 +264,300 @@ class TYMemoryAgent(Assistant):
         )
         
         # 初始化记忆系统
+        from ty_mem_agent.memory.memos_client import memory_manager
+        from ty_mem_agent.memory.user_memory import integrated_memory
         self.memory_manager = memory_manager
         self.integrated_memory = integrated_memory
         
-        logger.info(f"✅ 成功创建TY记忆智能代理: {self.name}")
-        logger.info(f"✅ 可用工具: {list(self.function_map.keys())}")
+        # 记忆写入队列，首次使用时在运行中的事件循环上创建
+        self._update_queue: Optional[asyncio.Queue] = None
+        self._writer_task: Optional[asyncio.Task] = None
+        
+        # 格式化后的记忆上下文缓存
+        self._context_cache: "OrderedDict[bytes, str]" = OrderedDict()
+        
+        logger.info("✅ 成功创建TY记忆智能代理: {}", self.name)
+        # 工具列表在预热时已经以INFO输出，每个代理只在DEBUG级别输出
+        logger.opt(lazy=True).debug("✅ 可用工具: {}", lambda: list(self.function_map))
     
     def _build_system_message(self) -> str:
         """构建系统消息"""
-        return """你是一个智能记忆助手，具备以下能力：
-
-🧠 记忆能力：
-- 长期记忆：记住用户的基本信息、偏好、历史对话
-- 上下文记忆：理解当前对话的上下文
-- 多用户支持：为不同用户提供个性化服务
-
-🛠️ 工具能力：
-- 天气查询：使用amap_weather工具查询天气
-- 叫车服务：使用didi_ride工具预约车辆
-- 智能分析：基于用户记忆提供个性化建议
-
-💡 交互原则：
-- 主动利用用户记忆提供个性化服务
-- 根据用户历史偏好调整回复风格
-- 在适当时机调用工具满足用户需求
-- 保持友好、专业的对话风格
-
-请根据用户的需求和记忆信息，提供最合适的帮助。"""
+        return _DEFAULT_SYSTEM_MESSAGE
     
     def _get_default_tools(self) -> List[Union[str, Dict, BaseTool]]:
         """获取默认工具列表"""
-        tools = []
-        
-        # 添加QwenAgent内置天气工具
-        try:
-            weather_tool = AmapWeather()
-            tools.append(weather_tool)
-            logger.info("✅ 添加QwenAgent内置天气工具")
-        except Exception as e:
-            logger.warning(f"⚠️ 无法添加天气工具: {e}")
+        return list(_load_default_tools())
+    
+    def prefetch_memory(self,
+                        messages: List[Any],
+                        user_id: str = "default_user",
+                        session_id: str = "default_session") -> asyncio.Task:
+        """提前开始获取用户记忆
         
-        # 添加自定义滴滴叫车工具
-        try:
-            didi_tool = QwenStyleDidiService()
-            tools.append(didi_tool)
-            logger.info("✅ 添加滴滴叫车工具")
-        except Exception as e:
-            logger.warning(f"⚠️ 无法添加滴滴工具: {e}")
+        返回的任务可以传给run_with_memory，调用方在此期间可以处理其他I/O
+        （如向客户端发送状态消息）。
+        """
+        user_query = _last_text_content(messages, USER)
+        return asyncio.create_task(self._get_user_memory(user_id, session_id, user_query))
+    
+    async def run_with_memory(self, 
+                              messages: List[Any], 
+                              user_id: str = "default_user",
+                              session_id: str = "default_session",
+                              memory_task: Optional[asyncio.Task] = None,
+                              **kwargs) -> AsyncIterator[List[Any]]:
+        """带记忆的对话运行（异步流式）
         
-        return tools
-    
-    def run_with_memory(self, 
-                       messages: List[Any], 
-                       user_id: str = "default_user",
-                       session_id: str = "default_session",
-                       **kwargs) -> List[Any]:
-        """带记忆的对话运行"""
+        Args:
+            memory_task: prefetch_memory返回的任务，不传时在这里开始获取
+        """
+        if memory_task is None:
+            memory_task = self.prefetch_memory(messages, user_id, session_id)
         try:
             # 获取用户记忆
-            user_memory = self._get_user_memory(user_id, session_id)
+            try:
+                user_memory = await memory_task
+            finally:
+                if not memory_task.done():
+                    memory_task.cancel()
             
             # 构建带记忆的消息
             enhanced_messages = self._enhance_messages_with_memory(messages, user_memory)
-            
-            # 运行对话
-            response = []
-            for chunk in self.run(messages=enhanced_messages, **kwargs):
-                response = chunk
-                yield chunk
-            
-            # 更新用户记忆
-            self._update_user_memory(user_id, session_id, messages, response)
-            
         except Exception as e:
             logger.error(f"❌ 带记忆对话运行失败: {e}")
+            logger.opt(exception=True).debug("run_with_memory 异常堆栈")
             # 回退到普通对话
-            for chunk in self.run(messages=messages, **kwargs):
+            async for chunk in self._run_async(messages, **kwargs):
                 yield chunk
+            return
+        
+        logger.opt(lazy=True).debug("📝 发送给模型的消息:\n{}", lambda: _format_prompt(enhanced_messages))
+        
+        # 运行对话（每个块都是完整的消息列表，最后一块即最终回复）
+        last = None
+        async for chunk in self._run_async(enhanced_messages, **kwargs):
+            last = chunk
+            yield chunk
+        if not last:
+            return
+        
+        # 更新用户记忆（后台写入，不阻塞响应结束）
+        self._schedule_memory_update(user_id, session_id, messages, last)
     
-    def _get_user_memory(self, user_id: str, session_id: str) -> Dict[str, Any]:
+    async def _run_async(self, messages: List[Any], **kwargs) -> AsyncIterator[List[Any]]:
+        """在线程池中驱动同步的run生成器
+        
+        QwenAgent的LLM调用是同步HTTP，逐块在工作线程中推进，
+        等待网络I/O期间让出事件循环，多个会话可以交错执行。
+        """
+        iterator: Iterator[List[Any]] = self.run(messages=messages, **kwargs)
+        try:
+            while True:
+                chunk = await asyncio.to_thread(next, iterator, _STREAM_END)
+                if chunk is _STREAM_END:
+                    break
+                yield chunk
+        finally:
+            # 调用方提前停止（断开连接、aclose、取消）时关闭生成器，释放底层HTTP流
+            try:
+                await asyncio.to_thread(iterator.close)
+            except ValueError:
+                # 取消时工作线程可能仍在执行next，此时无法关闭，由生成器结束后自行释放
+                logger.debug("⚠️ 生成器仍在执行，跳过关闭")
+    
+    async def _get_user_memory(self, user_id: str, session_id: str, user_query: str = "") -> Dict[str, Any]:
         """获取用户记忆"""
         try:
-            # 获取用户基本信息
-            user_profile = self.integrated_memory.get_user_profile(user_id)
-            
-            # 获取对话历史
-            conversation_history = self.integrated_memory.get_conversation_history(
-                user_id, session_id, limit=5
-            )
-            
-            return {
-                "user_profile": user_profile,
-                "conversation_history": conversation_history,
-                "session_id": session_id
-            }
+            # 用户画像、对话上下文、相关记忆和记忆洞察（并发获取）
+            return await self.integrated_memory.get_user_context(user_id, session_id, query=user_query)
         except Exception as e:
             logger.warning(f"⚠️ 获取用户记忆失败: {e}")
             return {}
     
     def _enhance_messages_with_memory(self, messages: List[Any], user_memory: Dict[str, Any]) -> List[Any]:
-        """用记忆增强消息"""
+        """用记忆增强消息
+        
+        用户画像放在开头的系统消息中，同一用户多轮对话内容保持不变，
+        便于模型服务端复用前缀KV缓存；对话历史、相关记忆等易变内容
+        附加到最后一条用户消息中（QwenAgent只允许一条系统消息）。
+        """
         try:
-            enhanced_messages = messages.copy()
+            if not messages or not user_memory:
+                return messages
             
-            # 添加用户记忆信息到第一条消息
-            if enhanced_messages and user_memory:
-                memory_context = self._format_memory_context(user_memory)
-                if memory_context:
-                    # 在第一条消息前添加记忆上下文
-                    enhanced_messages.insert(0, {
-                        "role": "system",
-                        "content": f"用户记忆信息：\n{memory_context}"
-                    })
+            # 稳定内容：用户画像放在最前面
+            head = []
+            profile_context = self._format_profile_context(user_memory)
+            if profile_context:
+                head.append(_profile_system_message(profile_context, isinstance(messages[0], Message)))
             
-            return enhanced_messages
+            # 易变内容：附加到最后一条用户消息
+            memory_context = self._format_memory_context(user_memory)
+            if memory_context:
+                for i in range(len(messages) - 1, -1, -1):
+                    if messages[i].get("role") == USER:
+                        last_user = self._prepend_to_message(messages[i], f"用户记忆信息：\n{memory_context}\n\n")
+                        return [*head, *messages[:i], last_user, *messages[i + 1:]]
+            
+            return [*head, *messages] if head else messages
         except Exception as e:
             logger.warning(f"⚠️ 记忆增强失败: {e}")
             return messages
     
+    @staticmethod
+    def _prepend_to_message(message: Any, text: str) -> Any:
+        """在消息内容前添加文本，返回新消息，不修改原消息"""
+        is_message = isinstance(message, Message)
+        content = message.get("content")
+        if isinstance(content, list):
+            text_item = ContentItem(text=text) if is_message else {"text": text}
+            new_content = [text_item] + content
+        else:
+            new_content = text + (content or "")
+        if is_message:
+            return message.model_copy(update={"content": new_content})
+        return {**message, "content": new_content}
+    
+    def _format_profile_context(self, user_memory: Dict[str, Any]) -> str:
+        """格式化用户画像（字段顺序固定，相同画像复用同一字符串）"""
+        user_profile = user_memory.get("user_profile") or {}
+        values = []
+        for field, _ in _PROFILE_FIELDS:
+            value = user_profile.get(field)
+            if isinstance(value, list):
+                value = tuple(value)
+            values.append(value)
+        return _render_profile(tuple(values))
+    
     def _format_memory_context(self, user_memory: Dict[str, Any]) -> str:
-        """格式化记忆上下文"""
+        """格式化记忆上下文（输入未变化时复用上一次的结果）"""
+        try:
+            cache_key = self._memory_context_key(user_memory)
+        except Exception as e:
+            logger.warning(f"⚠️ 计算记忆上下文缓存键失败: {e}")
+            return self._build_memory_context(user_memory)
+        
+        memory_context = self._context_cache.get(cache_key)
+        if memory_context is not None:
+            self._context_cache.move_to_end(cache_key)
+            return memory_context
+        
+        memory_context = self._build_memory_context(user_memory)
+        self._context_cache[cache_key] = memory_context
+        if len(self._context_cache) > _CONTEXT_CACHE_SIZE:
+            self._context_cache.popitem(last=False)
+        return memory_context
+    
+    @staticmethod
+    def _memory_context_key(user_memory: Dict[str, Any]) -> bytes:
+        """根据对话历史、相关记忆和洞察的标识生成缓存键"""
+        conversation_context = user_memory.get("conversation_context") or {}
+        history = conversation_context.get("conversation_history", [])
+        last_turn = history[-1].get("timestamp", "") if history else ""
+        memory_ids = ",".join(str(m.get("memory_id") or m.get("content", ""))
+                              for m in user_memory.get("relevant_memories", [])[:5])
+        insights_sig = ",".join(f"{i.get('type', '')}@{i.get('created_at', '')}"
+                                for i in user_memory.get("insights", [])[:5])
+        signature = f"{user_memory.get('session_id', '')}|{len(history)}|{last_turn}|{memory_ids}|{insights_sig}"
+        return hashlib.blake2s(signature.encode("utf-8"), digest_size=16).digest()
+    
+    def _build_memory_context(self, user_memory: Dict[str, Any]) -> str:
+        """格式化记忆上下文（对话历史、相关记忆、最近话题）"""
         try:
             context_parts = []
             
-            # 用户基本信息
-            user_profile = user_memory.get("user_profile", {})
-            if user_profile:
-                context_parts.append(f"用户信息: {user_profile}")
-            
             # 对话历史
-            conversation_history = user_memory.get("conversation_history", [])
+            conversation_context = user_memory.get("conversation_context") or {}
+            conversation_history = conversation_context.get("conversation_history", [])[-5:]
             if conversation_history:
-                context_parts.append(f"最近对话: {conversation_history}")
+                context_parts.append("最近对话:\n" + "\n".join(
+                    f"- 用户: {turn.get('message', '')} | 助手: {turn.get('response', '')}"
+                    for turn in conversation_history
+                ))
+            
+            # 相关记忆（取最相关的5条，按记忆ID排序保证输出稳定）
+            relevant_memories = user_memory.get("relevant_memories", [])
+            if relevant_memories:
+                top_memories = sorted(relevant_memories[:5], key=lambda m: str(m.get("memory_id", "")))
+                context_parts.append("相关记忆:\n" + "\n".join(
+                    f"- {_truncate_memory_text(str(memory.get('content', '')))}" for memory in top_memories
+                ))
             
-            return "\n".join(context_parts) if context_parts else ""
+            # 记忆洞察
+            insights = user_memory.get("insights", [])
+            if insights:
+                insight_types = sorted({insight.get("type", "") for insight in insights[:5]})
+                context_parts.append(f"最近话题: {', '.join(insight_types)}")
+            
+            return "\n".join(context_parts)
         except Exception as e:
             logger.warning(f"⚠️ 格式化记忆上下文失败: {e}")
             return ""
     
-    def _update_user_memory(self, 
-                           user_id: str, 
-                           session_id: str, 
-                           messages: List[Any], 
-                           response: List[Any]):
+    def _schedule_memory_update(self,
+                                user_id: str,
+                                session_id: str,
+                                messages: List[Any],
+                                response: List[Any]) -> None:
+        """将记忆更新放入队列，由后台任务写入"""
+        if self._update_queue is None:
+            self._update_queue = asyncio.Queue(maxsize=_MEMORY_QUEUE_SIZE)
+        if self._writer_task is None or self._writer_task.done():
+            self._writer_task = asyncio.create_task(self._memory_writer())
+        try:
+            self._update_queue.put_nowait((user_id, session_id, messages, response))
+        except asyncio.QueueFull:
+            logger.warning(f"⚠️ 记忆更新队列已满，丢弃本轮更新: user={user_id}")
+    
+    async def _memory_writer(self):
+        """后台记忆写入任务"""
+        while True:
+            item = await self._update_queue.get()
+            try:
+                await self._update_user_memory(*item)
+            finally:
+                self._update_queue.task_done()
+    
+    async def flush_memory_updates(self):
+        """等待队列中的记忆更新全部写入"""
+        if self._update_queue is not None:
+            await self._update_queue.join()
+    
+    async def close(self):
+        """写完队列中的记忆更新并停止后台写入任务（连接断开时调用）"""
+        await self.flush_memory_updates()
+        if self._writer_task is not None:
+            self._writer_task.cancel()
+            self._writer_task = None
+    
+    async def _update_user_memory(self, 
+                                  user_id: str, 
+                                  session_id: str, 
+                                  messages: List[Any], 
+                                  response: List[Any]):
         """更新用户记忆"""
         try:
-            # 保存对话到记忆系统
-            self.integrated_memory.save_conversation(
-                user_id, session_id, messages, response
-            )
+            user_message = _last_text_content(messages, USER)
+            assistant_message = _last_text_content(response, ASSISTANT)
             
-            # 分析并更新用户偏好
-            self._analyze_user_preferences(user_id, messages, response)
+            # 保存对话和本轮分析出的用户偏好（一次写入）
+            await self.integrated_memory.save_conversation(
+                user_id, session_id, user_message, assistant_message,
+                preferences=self._analyze_user_preferences(response)
+            )
             
         except Exception as e:
             logger.warning(f"⚠️ 更新用户记忆失败: {e}")
     
-    def _analyze_user_preferences(self, 
-                                 user_id: str, 
-                                 messages: List[Any], 
-                                 response: List[Any]):
-        """分析用户偏好"""
-        try:
-            # 简单的偏好分析逻辑
-            # 实际应用中可以使用更复杂的NLP分析
-            
-            # 检查是否使用了工具
-            tool_usage = []
-            for msg in response:
-                if hasattr(msg, 'function_call') and msg.function_call:
-                    tool_usage.append(msg.function_call.name)
-            
-            if tool_usage:
-                # 更新用户工具使用偏好
-                self.integrated_memory.update_user_preferences(
-                    user_id, {"preferred_tools": tool_usage}
-                )
-                
-        except Exception as e:
-            logger.warning(f"⚠️ 分析用户偏好失败: {e}")
+    def _analyze_user_preferences(self, response: List[Any]) -> Dict[str, Any]:
+        """分析用户偏好，未发现偏好时返回空字典"""
+        # 简单的偏好分析逻辑：记录用户使用过的工具（去重，保持调用顺序）
+        # 实际应用中可以使用更复杂的NLP分析
+        tool_usage = list(dict.fromkeys(
+            function_call["name"] for function_call in (msg.get("function_call") for msg in response)
+            if function_call
+        ))
+        return {"preferred_tools": tool_usage} if tool_usage else {}
 
 
 if __name__ == "__main__":
@@ -263,7 +565,7 @@ if __name__ == "__main__":
     from ty_mem_agent.utils.logger_config import get_logger
     test_logger = get_logger("TYMemoryAgentTest")
     
-    def test_ty_memory_agent():
+    async def test_ty_memory_agent():
         test_logger.info("🧪 测试TY记忆智能代理...")
         
         try:
@@ -279,18 +581,17 @@ if __name__ == "__main__":
             ]
             
             test_logger.info("🎯 测试带记忆的对话...")
-            for response in agent.run_with_memory(
+            async for response in agent.run_with_memory(
                 messages=test_messages,
                 user_id="zhang_san",
                 session_id="test_session"
             ):
                 test_logger.info(f"📝 响应: {response}")
+            await agent.flush_memory_updates()
             
             test_logger.info("🎉 TY记忆智能代理测试完成！")
             
         except Exception as e:
-            test_logger.error(f"❌ 测试失败: {e}")
-            import traceback
-            traceback.print_exc()
+            test_logger.opt(exception=True).error(f"❌ 测试失败: {e}")
     
-    test_ty_memory_agent()
+    asyncio.run(test_ty_memory_agent())
@@ -4,13 +4,39 @@ TY Memory Agent 配置文件
 """
 
 import os
+from dataclasses import dataclass
+from functools import lru_cache
 from typing import Dict, List, Optional
-from pydantic import Field
-from pydantic_settings import BaseSettings
+from pydantic import Field, PrivateAttr
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+
+@dataclass(slots=True, frozen=True)
+class AgentCfg:
+    """Agent配置"""
+    max_memory_context: int = 10  # 最大记忆上下文轮数
+    enable_proactive_memory: bool = True  # 启用主动记忆
+    memory_update_threshold: int = 3  # 记忆更新阈值
+    mcp_selection_strategy: str = "auto"  # MCP选择策略: auto/manual/router
+
+
+@dataclass(slots=True, frozen=True)
+class ChatCfg:
+    """聊天配置"""
+    max_message_length: int = 2000
+    session_timeout_minutes: int = 60
+    enable_message_history: bool = True
+    max_history_messages: int = 50
 
 
 class Settings(BaseSettings):
-    """系统配置"""
+    """系统配置（运行期间只读）"""
+    
+    model_config = SettingsConfigDict(
+        env_file=".env",
+        case_sensitive=True,
+        frozen=True,
+    )
     
     # === 基础配置 ===
     PROJECT_NAME: str = "TY Memory Agent"
@@ -54,9 +80,17 @@ class Settings(BaseSettings):
     AMAP_TOKEN: Optional[str] = Field(default=None, env="AMAP_TOKEN")
     
     # === MCP服务配置 ===
+    _mcp_services: Optional[Dict[str, Dict]] = PrivateAttr(default=None)
+    
     @property
     def MCP_SERVICES(self) -> Dict[str, Dict]:
-        """动态生成MCP服务配置，包含实际的API密钥"""
+        """MCP服务配置，包含实际的API密钥（首次访问时生成）"""
+        if self._mcp_services is None:
+            self._mcp_services = self._build_mcp_services()
+        return self._mcp_services
+    
+    def _build_mcp_services(self) -> Dict[str, Dict]:
+        """生成MCP服务配置"""
         return {
             "didi_ride": {
                 "enabled": True,
@@ -83,28 +117,14 @@ class Settings(BaseSettings):
         }
     
     # === Agent配置 ===
-    AGENT_CONFIG: Dict = {
-        "max_memory_context": 10,  # 最大记忆上下文轮数
-        "enable_proactive_memory": True,  # 启用主动记忆
-        "memory_update_threshold": 3,  # 记忆更新阈值
-        "mcp_selection_strategy": "auto",  # MCP选择策略: auto/manual/router
-    }
+    AGENT_CONFIG: AgentCfg = Field(default_factory=AgentCfg)
     
     # === 聊天配置 ===
-    CHAT_CONFIG: Dict = {
-        "max_message_length": 2000,
-        "session_timeout_minutes": 60,
-        "enable_message_history": True,
-        "max_history_messages": 50
-    }
+    CHAT_CONFIG: ChatCfg = Field(default_factory=ChatCfg)
     
     # === 日志配置 ===
     LOG_LEVEL: str = Field(default="INFO", env="LOG_LEVEL")
     LOG_FILE: str = Field(default="logs/ty_mem_agent.log", env="LOG_FILE")
-    
-    class Config:
-        env_file = ".env"
-        case_sensitive = True
 
 
 # 全局设置实例
@@ -112,7 +132,13 @@ settings = Settings()
 
 
 def get_llm_config() -> Dict:
-    """获取LLM配置"""
+    """获取LLM配置（返回副本，调用方可以自由修改）"""
+    return dict(_get_llm_config())
+
+
+@lru_cache(maxsize=1)
+def _get_llm_config() -> Dict:
+    """根据配置生成LLM配置（只计算一次）"""
     if settings.DASHSCOPE_API_KEY:
         return {
             'model': settings.DEFAULT_LLM_MODEL,
@@ -131,6 +157,12 @@ def get_llm_config() -> Dict:
 
 def get_available_mcp_services() -> List[str]:
     """获取可用的MCP服务列表"""
+    return list(_get_available_mcp_services())
+
+
+@lru_cache(maxsize=1)
+def _get_available_mcp_services() -> tuple:
+    """计算可用的MCP服务（只计算一次）"""
     available = []
     for service_name, config in settings.MCP_SERVICES.items():
         if config.get("enabled", False):
@@ -139,7 +171,7 @@ def get_available_mcp_services() -> List[str]:
             if api_key is None:
                 continue
             available.append(service_name)
-    return available
+    return tuple(available)
 
 
 def validate_configuration():
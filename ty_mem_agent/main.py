@@ -7,15 +7,19 @@ TY Memory Agent 主程序
 import asyncio
 import sys
 import signal
-from pathlib import Path
 
-# 添加项目路径
-sys.path.append(str(Path(__file__).parent.parent))
+if __name__ == "__main__":
+    # 直接运行本文件时添加项目根目录（推荐使用 python -m ty_mem_agent）
+    from pathlib import Path
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from ty_mem_agent.config.settings import settings, validate_configuration
+from ty_mem_agent.server.chat_server import ChatServer
+from ty_mem_agent.memory.memos_client import cleanup_memory_manager
+from ty_mem_agent.utils.logger_config import setup_logger, get_logger
 
-from config.settings import settings, validate_configuration
-from server.chat_server import ChatServer
-from memory.memos_client import cleanup_memory_manager
-from utils.logger_config import setup_logger, get_logger
+# 配置信息横幅分隔线
+_BANNER_RULE = "=" * 50
 
 
 class TYMemoryAgentApp:
@@ -24,6 +28,8 @@ class TYMemoryAgentApp:
     def __init__(self):
         self.chat_server = None
         self.running = False
+        # 收到退出信号时设置，run()等待该事件后按顺序关闭
+        self._shutdown_event = asyncio.Event()
         
         # 配置日志
         self._setup_logging()
@@ -36,7 +42,9 @@ class TYMemoryAgentApp:
             level=settings.LOG_LEVEL,
             log_file=settings.LOG_FILE,
             rotation="10 MB",
-            retention="7 days"
+            retention="7 days",
+            enqueue=True,
+            force=True
         )
         
         # 获取logger实例
@@ -71,26 +79,40 @@ class TYMemoryAgentApp:
     
     def _display_config(self):
         """显示配置信息"""
-        self.logger.info("=" * 50)
-        self.logger.info("📋 TY Memory Agent 配置信息")
-        self.logger.info("=" * 50)
-        self.logger.info(f"🌐 服务地址: http://{settings.HOST}:{settings.PORT}")
-        self.logger.info(f"🤖 LLM模型: {settings.DEFAULT_LLM_MODEL}")
-        self.logger.info(f"🧠 记忆系统: {settings.MEMOS_API_BASE}")
-        self.logger.info(f"🔧 MCP服务: {len([s for s in settings.MCP_SERVICES.values() if s.get('enabled')])} 个已启用")
-        self.logger.info(f"📊 调试模式: {'开启' if settings.DEBUG else '关闭'}")
-        self.logger.info(f"📝 日志级别: {settings.LOG_LEVEL}")
-        self.logger.info("=" * 50)
+        enabled_services = sum(1 for s in settings.MCP_SERVICES.values() if s.get('enabled'))
+        banner = "\n".join([
+            _BANNER_RULE,
+            "📋 TY Memory Agent 配置信息",
+            _BANNER_RULE,
+            f"🌐 服务地址: http://{settings.HOST}:{settings.PORT}",
+            f"🤖 LLM模型: {settings.DEFAULT_LLM_MODEL}",
+            f"🧠 记忆系统: {settings.MEMOS_API_BASE}",
+            f"🔧 MCP服务: {enabled_services} 个已启用",
+            f"📊 调试模式: {'开启' if settings.DEBUG else '关闭'}",
+            f"📝 日志级别: {settings.LOG_LEVEL}",
+            _BANNER_RULE,
+        ])
+        self.logger.info(f"\n{banner}")
     
     def _setup_signal_handlers(self):
-        """设置信号处理器"""
-        def signal_handler(signum, frame):
+        """设置信号处理器（在事件循环中调用）
+        
+        服务运行期间由uvicorn接管信号并自行优雅退出，退出后会恢复这里的处理器并重新触发信号；
+        服务启动前收到的信号由ChatServer.stop_server记录，start_server不再启动。
+        """
+        loop = asyncio.get_running_loop()
+        
+        def signal_handler(signum):
             self.logger.info(f"📡 收到信号 {signum}，开始优雅关闭...")
-            asyncio.create_task(self.shutdown())
+            self._shutdown_event.set()
         
         # 注册信号处理器
-        signal.signal(signal.SIGINT, signal_handler)
-        signal.signal(signal.SIGTERM, signal_handler)
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signum, signal_handler, signum)
+            except NotImplementedError:
+                # Windows事件循环不支持add_signal_handler，回退到signal.signal
+                signal.signal(signum, lambda sig, frame: loop.call_soon_threadsafe(signal_handler, sig))
     
     async def run(self):
         """运行应用"""
@@ -101,8 +123,17 @@ class TYMemoryAgentApp:
             self.running = True
             self.logger.info("🚀 TY Memory Agent 启动中...")
             
-            # 启动聊天服务器
-            await self.chat_server.start_server()
+            # 启动聊天服务器，直到服务器退出或收到退出信号
+            server_task = asyncio.create_task(self.chat_server.start_server())
+            shutdown_task = asyncio.create_task(self._shutdown_event.wait())
+            done, _ = await asyncio.wait({server_task, shutdown_task},
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if shutdown_task in done:
+                self.chat_server.stop_server()
+                await server_task
+            else:
+                shutdown_task.cancel()
+                server_task.result()
             
         except Exception as e:
             self.logger.error(f"❌ 运行错误: {e}")
@@ -3,8 +3,17 @@
 MCP (Model Context Protocol) 服务集成模块
 """
 
-from .enhanced_mcp_router import EnhancedMCPRouter, MCPService, MCPRequest, MCPResponse
-from .qwen_style_didi_service import QwenStyleDidiService
+import importlib
+import os
+
+# 按需导入（PEP 562）：只用滴滴工具时不加载路由器，反之亦然
+_LAZY_IMPORTS = {
+    'EnhancedMCPRouter': '.enhanced_mcp_router',
+    'MCPService': '.enhanced_mcp_router',
+    'MCPRequest': '.enhanced_mcp_router',
+    'MCPResponse': '.enhanced_mcp_router',
+    'QwenStyleDidiService': '.qwen_style_didi_service',
+}
 
 __all__ = [
     'EnhancedMCPRouter',
@@ -13,3 +22,22 @@ __all__ = [
     'MCPResponse',
     'QwenStyleDidiService'
 ]
+
+
+def __getattr__(name):
+    module_name = _LAZY_IMPORTS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module_name, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
+
+
+# TY_EAGER_IMPORT=1 时立即导入全部子模块，便于发现延迟导入引入的问题
+if os.getenv("TY_EAGER_IMPORT") == "1":
+    for _name in __all__:
+        __getattr__(_name)
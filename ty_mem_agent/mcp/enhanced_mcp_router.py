@@ -5,11 +5,17 @@
 """
 
 import asyncio
+import copy
+import hashlib
 import json
-from typing import Dict, List, Optional, Any, Iterator, Union
+import threading
+import time
+from typing import Deque, Dict, List, Optional, Any, Iterator, Sequence, Tuple, Union
 from abc import ABC, abstractmethod
-from dataclasses import dataclass
+from collections import OrderedDict, deque
+from dataclasses import dataclass, replace
 from datetime import datetime
+from graphlib import CycleError, TopologicalSorter
 from loguru import logger
 
 # QwenAgent imports
@@ -20,6 +26,68 @@ from qwen_agent.tools import BaseTool
 
 # 使用简洁的绝对导入
 from ty_mem_agent.config.settings import settings
+from ty_mem_agent.utils import json_utils
+
+# LLM响应中的JSON代码块标记
+_JSON_FENCE = "```json"
+
+# 日志中输出的响应内容最大长度
+_LOG_CONTENT_MAX = 500
+
+# 意图分析的生成参数：低温度使相同输入的结果稳定（便于缓存），限制输出长度只保留JSON所需
+_INTENT_GENERATE_CFG = {"max_tokens": 512, "temperature": 0.1}
+
+# 路由历史最多保留的条目数，以及每条记录保留的意图长度
+_REQUEST_HISTORY_MAX = 1024
+_HISTORY_INTENT_MAX = 200
+
+# 单个服务健康检查的超时时间（秒）
+_HEALTH_CHECK_TIMEOUT = 2.0
+
+
+def _truncate_for_log(content: str) -> str:
+    """截断过长的内容，避免日志写入整段响应"""
+    if len(content) <= _LOG_CONTENT_MAX:
+        return content
+    return f"{content[:_LOG_CONTENT_MAX]}... (共 {len(content)} 字符, 已截断)"
+
+
+def _extract_json_block(content: str) -> Optional[str]:
+    """提取LLM响应中的JSON对象（优先```json代码块），没有时返回None"""
+    # 单次扫描匹配成对花括号，跳过字符串中的括号和转义字符，支持嵌套对象和尾随文字
+    fence = content.find(_JSON_FENCE)
+    start = content.find("{", fence + len(_JSON_FENCE) if fence >= 0 else 0)
+    if start < 0:
+        return None
+    
+    depth = 0
+    in_string = False
+    escaped = False
+    for i in range(start, len(content)):
+        ch = content[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch == "{":
+            depth += 1
+        elif ch == "}":
+            depth -= 1
+            if depth == 0:
+                return content[start:i + 1]
+    return None
+
+
+def _json_block_closed(content: str) -> bool:
+    """流式响应中的JSON对象是否已完整（仅在出现```json代码块或以"{"开头时判断，避免截断说明文字中的花括号）"""
+    if _JSON_FENCE not in content and not content.lstrip().startswith("{"):
+        return False
+    return _extract_json_block(content) is not None
 
 
 @dataclass
@@ -79,9 +147,8 @@ class MCPService(ABC):
 class LLMIntentAnalyzer:
     """基于LLM的意图分析器"""
     
-    def __init__(self, llm: BaseChatModel):
-        self.llm = llm
-        self.system_prompt = """你是一个智能意图分析专家，能够理解用户的复杂需求并分解为具体的执行步骤。
+    # 静态提示在前、服务列表在后，相同服务集合下系统提示逐字节一致，便于服务端前缀缓存
+    _PROMPT_PREAMBLE = """你是一个智能意图分析专家，能够理解用户的复杂需求并分解为具体的执行步骤。
 
 你的任务：
 1. 分析用户输入的意图
@@ -89,9 +156,6 @@ class LLMIntentAnalyzer:
 3. 提供推理过程（Chain of Thought）
 4. 输出结构化的分析结果
 
-可用服务：
-{service_descriptions}
-
 分析格式：
 ```json
 {
@@ -106,52 +170,106 @@ class LLMIntentAnalyzer:
     "parameters": {
         "service1": {"param1": "value1"},
         "service2": {"param2": "value2"}
+    },
+    "dependencies": {
+        "service2": ["service1"]
     }
 }
-```"""
+```
+dependencies为可选字段，仅在某服务需要等待其他服务结果时填写，相互独立的服务不要填写。
+
+可用服务：
+"""
+    
+    def __init__(self, llm: BaseChatModel, cache_size: int = 256):
+        self.llm = llm
+        # 分析结果LRU缓存：系统提示和用户输入的摘要 -> 分析结果
+        self._result_cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._cache_size = cache_size
+        self._system_prompts: Dict[tuple, str] = {}
+    
+    @staticmethod
+    def _services_signature(available_services: Sequence[MCPService]) -> tuple:
+        """已启用服务的签名（按名称排序，与注册顺序无关）"""
+        return tuple(sorted(
+            (service.name, service.description, tuple(service.capabilities))
+            for service in available_services
+            if service.enabled
+        ))
+    
+    def _get_system_prompt(self, signature: tuple) -> str:
+        """按服务签名获取系统提示，同一服务集合只拼接一次"""
+        prompt = self._system_prompts.get(signature)
+        if prompt is None:
+            service_desc_text = '\n'.join(
+                f"- {name}: {description} (能力: {', '.join(capabilities)})"
+                for name, description, capabilities in signature
+            )
+            prompt = self._PROMPT_PREAMBLE + service_desc_text
+            self._system_prompts[signature] = prompt
+        return prompt
+    
+    def _cache_result(self, cache_key: str, result: Dict[str, Any]) -> None:
+        """缓存分析结果（保存副本），超出容量时淘汰最久未使用的条目"""
+        self._result_cache[cache_key] = copy.deepcopy(result)
+        self._result_cache.move_to_end(cache_key)
+        while len(self._result_cache) > self._cache_size:
+            self._result_cache.popitem(last=False)
 
-    async def analyze_intent(self, text: str, available_services: List[MCPService], context: Dict = None) -> Dict[str, Any]:
+    async def analyze_intent(self, text: str, available_services: Sequence[MCPService], context: Dict = None) -> Dict[str, Any]:
         """使用LLM分析用户意图"""
         try:
-            # 构建服务描述
-            service_descriptions = []
-            for service in available_services:
-                if service.enabled:
-                    service_descriptions.append(f"- {service.name}: {service.description} (能力: {', '.join(service.capabilities)})")
-            
-            service_desc_text = '\n'.join(service_descriptions)
+            system_prompt = self._get_system_prompt(self._services_signature(available_services))
             
             # 构建提示
             prompt = f"用户输入：{text}\n\n上下文：{context or '无'}\n\n请分析用户意图并输出JSON格式的分析结果。"
             
+            # 相同输入和服务集合直接返回缓存结果（副本，调用方修改不影响缓存），不再调用LLM
+            cache_key = hashlib.sha1(f"{system_prompt}\0{prompt}".encode("utf-8")).hexdigest()
+            cached = self._result_cache.get(cache_key)
+            if cached is not None:
+                self._result_cache.move_to_end(cache_key)
+                logger.debug("📋 使用缓存意图分析: {}", cached.get("primary_intent"))
+                return copy.deepcopy(cached)
+            
             messages = [
-                Message(role=SYSTEM, content=self.system_prompt.format(service_descriptions=service_desc_text)),
+                Message(role=SYSTEM, content=system_prompt),
                 Message(role=USER, content=prompt)
             ]
             
-            # 调用LLM
-            response = []
-            for resp in self.llm.chat(messages=messages, stream=False):
-                response = resp
-            
-            # 解析响应
-            content = response[-1].content if response else ""
+            # 流式调用LLM，JSON对象闭合后立即停止接收剩余输出
+            content = ""
+            stream = self.llm.chat(messages=messages, stream=True, extra_generate_cfg=_INTENT_GENERATE_CFG)
+            try:
+                for response in stream:
+                    new_content = response[-1].content if response else ""
+                    if not isinstance(new_content, str):
+                        continue
+                    # 流式输出为累积内容，仅在新增片段出现"}"时检查是否闭合
+                    closed = "}" in new_content[len(content):]
+                    content = new_content
+                    if closed and _json_block_closed(content):
+                        break
+            finally:
+                # 提前退出时关闭生成器，释放底层HTTP流
+                close = getattr(stream, "close", None)
+                if close is not None:
+                    close()
             
             # 尝试提取JSON
             try:
-                # 查找JSON块
-                import re
-                json_match = re.search(r'```json\s*(\{.*?\})\s*```', content, re.DOTALL)
-                if json_match:
-                    json_str = json_match.group(1)
-                    result = json.loads(json_str)
-                    return result
+                # 查找JSON对象
+                json_str = _extract_json_block(content)
+                if json_str is not None:
+                    result = json_utils.loads(json_str)
                 else:
-                    # 如果没有找到JSON块，尝试直接解析
-                    result = json.loads(content)
-                    return result
+                    # 如果没有找到JSON对象，尝试直接解析
+                    result = json_utils.loads(content)
+                if isinstance(result, dict):
+                    self._cache_result(cache_key, result)
+                return result
             except json.JSONDecodeError:
-                logger.warning(f"无法解析LLM响应为JSON: {content}")
+                logger.warning("无法解析LLM响应为JSON: {}", _truncate_for_log(content))
                 return {
                     "primary_intent": "general",
                     "confidence": 0.5,
@@ -185,6 +303,7 @@ class EnhancedMCPRouter(Assistant):
         if services:
             for service in services:
                 self.services[service.name] = service
+        self._refresh_enabled_services()
         
         # 初始化意图分析器
         self.intent_analyzer = LLMIntentAnalyzer(llm) if llm else None
@@ -219,7 +338,8 @@ Parameters: {{"param": "value"}}  # 服务参数
         
         # 性能统计
         self.performance_stats: Dict[str, Dict] = {}
-        self.request_history: List[MCPRequest] = []
+        # 路由历史（有界），只记录 (时间, 用户, 意图摘要, 服务名)，不持有完整请求
+        self.request_history: Deque[Tuple[datetime, str, str, str]] = deque(maxlen=_REQUEST_HISTORY_MAX)
     
     def _build_service_descriptions(self) -> str:
         """构建服务描述"""
@@ -232,33 +352,57 @@ Parameters: {{"param": "value"}}  # 服务参数
                 descriptions.append("")
         return '\n'.join(descriptions)
     
+    def _refresh_enabled_services(self) -> None:
+        """重建已启用服务元组（服务注册或启停时调用，路由时直接遍历）"""
+        self._enabled_services: Tuple[MCPService, ...] = tuple(
+            service for service in self.services.values() if service.enabled
+        )
+    
+    def set_service_enabled(self, service_name: str, enabled: bool) -> bool:
+        """启用或停用服务（请通过此方法修改，直接改service.enabled不会刷新路由）"""
+        service = self.services.get(service_name)
+        if service is None:
+            return False
+        service.enabled = enabled
+        self._refresh_enabled_services()
+        return True
+    
     def register_service(self, service: MCPService) -> None:
         """注册MCP服务"""
         self.services[service.name] = service
+        self._refresh_enabled_services()
         self.performance_stats[service.name] = {
             "total_requests": 0,
             "successful_requests": 0,
             "average_response_time": 0.0,
+            "response_time_variance": 0.0,
+            "max_response_time": 0.0,
             "last_used": None
         }
-        logger.info(f"📋 注册MCP服务: {service.name}")
+        logger.info("📋 注册MCP服务: {}", service.name)
     
     async def route_request(self, request: MCPRequest, strategy: str = "llm") -> MCPResponse:
         """路由请求到合适的服务"""
-        start_time = datetime.now()
+        # 单调时钟计时，不受系统时间调整影响
+        start_time = time.perf_counter()
         
         try:
             if strategy == "llm" and self.intent_analyzer:
                 # 使用LLM进行意图分析
                 analysis = await self.intent_analyzer.analyze_intent(
                     request.intent, 
-                    list(self.services.values()), 
+                    self._enabled_services, 
                     request.context
                 )
                 
                 # 根据分析结果选择服务
-                if analysis.get("required_services"):
-                    service_name = analysis["required_services"][0]
+                service_names = list(dict.fromkeys(
+                    name for name in analysis.get("required_services") or [] if name in self.services
+                ))
+                if len(service_names) > 1:
+                    return await self._execute_services(request, service_names, analysis, start_time)
+                if service_names:
+                    service_name = service_names[0]
                     if service_name in self.services:
                         service = self.services[service_name]
                         
@@ -266,22 +410,20 @@ Parameters: {{"param": "value"}}  # 服务参数
                         if analysis.get("parameters", {}).get(service_name):
                             request.parameters.update(analysis["parameters"][service_name])
                         
-                        # 执行服务
-                        response = await service.execute(request)
+                        # 执行服务（同时更新统计）
+                        response = await self._execute_service(service, request)
                         
                         # 添加推理步骤
                         if analysis.get("reasoning"):
                             response.reasoning_steps = analysis["reasoning"]
                         
-                        # 更新统计
-                        self._update_performance_stats(service.name, response, start_time)
-                        self.request_history.append(request)
+                        self._record_request(request, service.name)
                         
-                        logger.info(f"🎯 LLM路由成功: {request.intent} -> {service.name}")
+                        logger.info("🎯 LLM路由成功: {} -> {}", request.intent, service.name)
                         return response
             
             # 回退到传统路由
-            return await self._fallback_route(request, start_time)
+            return await self._fallback_route(request)
             
         except Exception as e:
             logger.error(f"❌ 路由失败: {e}")
@@ -293,30 +435,99 @@ Parameters: {{"param": "value"}}  # 服务参数
                 reasoning_steps=[f"路由失败: {str(e)}"]
             )
     
-    async def _fallback_route(self, request: MCPRequest, start_time: datetime) -> MCPResponse:
+    @staticmethod
+    def _plan_layers(service_names: List[str], dependencies: Dict[str, List[str]]) -> List[List[str]]:
+        """按依赖关系把服务分层，同一层内的服务互不依赖；存在循环依赖时逐个顺序执行"""
+        graph = {
+            name: [dep for dep in dependencies.get(name) or [] if dep in service_names and dep != name]
+            for name in service_names
+        }
+        sorter = TopologicalSorter(graph)
+        try:
+            sorter.prepare()
+        except CycleError:
+            logger.warning("⚠️ 服务依赖存在循环，改为顺序执行: {}", service_names)
+            return [[name] for name in service_names]
+        
+        layers = []
+        while sorter.is_active():
+            # 层内保持LLM给出的服务顺序
+            ready = sorted(sorter.get_ready(), key=service_names.index)
+            layers.append(ready)
+            sorter.done(*ready)
+        return layers
+    
+    async def _execute_services(self, request: MCPRequest, service_names: List[str],
+                                analysis: Dict[str, Any], start_time: float) -> MCPResponse:
+        """执行多个服务：按依赖分层，同一层内并发调用
+        
+        依赖的上游服务结果通过参数upstream_results（服务名 -> 结果）传给下游服务。
+        """
+        parameters = analysis.get("parameters") or {}
+        dependencies = analysis.get("dependencies")
+        if not isinstance(dependencies, dict):
+            dependencies = {}
+        
+        responses: Dict[str, MCPResponse] = {}
+        for layer in self._plan_layers(service_names, dependencies):
+            layer_requests = []
+            for name in layer:
+                layer_parameters = {**request.parameters, **(parameters.get(name) or {})}
+                # 循环依赖顺序执行时，尚未执行的上游服务不传
+                upstream = [dep for dep in dependencies.get(name) or [] if dep in responses and dep != name]
+                if upstream:
+                    layer_parameters["upstream_results"] = {dep: responses[dep].result for dep in upstream}
+                layer_requests.append(replace(request, parameters=layer_parameters))
+            results = await asyncio.gather(
+                *(self._execute_service(self.services[name], req) for name, req in zip(layer, layer_requests)),
+                return_exceptions=True
+            )
+            for name, result in zip(layer, results):
+                if isinstance(result, BaseException):
+                    result = MCPResponse(
+                        service_name=name,
+                        success=False,
+                        result=None,
+                        error=f"服务执行错误: {str(result)}"
+                    )
+                responses[name] = result
+        
+        self._record_request(request, ",".join(service_names))
+        
+        # 汇总各服务的结果与推理步骤
+        reasoning_steps = list(analysis.get("reasoning") or [])
+        for response in responses.values():
+            reasoning_steps.extend(response.reasoning_steps)
+        errors = [f"{name}: {response.error}" for name, response in responses.items() if response.error]
+        
+        logger.info("🎯 LLM路由成功: {} -> {}", request.intent, service_names)
+        return MCPResponse(
+            service_name=",".join(service_names),
+            success=all(response.success for response in responses.values()),
+            result={name: response.result for name, response in responses.items()},
+            error="; ".join(errors) or None,
+            execution_time=time.perf_counter() - start_time,
+            metadata={"responses": responses},
+            reasoning_steps=reasoning_steps
+        )
+    
+    async def _fallback_route(self, request: MCPRequest) -> MCPResponse:
         """回退路由策略"""
-        # 简单的关键词匹配
+        # 简单的关键词匹配（意图文本只转换一次小写）
+        intent = request.intent.lower()
         best_service = None
         best_score = 0.0
         
-        for service_name, service in self.services.items():
-            if not service.enabled:
-                continue
-            
+        for service in self._enabled_services:
             # 计算匹配度
-            score = 0.0
-            for keyword in service.keywords:
-                if keyword.lower() in request.intent.lower():
-                    score += 1.0
+            score = float(sum(1 for keyword in service.keywords if keyword.lower() in intent))
             
             if score > best_score:
                 best_score = score
                 best_service = service
         
         if best_service and best_score > 0:
-            response = await best_service.execute(request)
-            self._update_performance_stats(best_service.name, response, start_time)
-            return response
+            return await self._execute_service(best_service, request)
         
         return MCPResponse(
             service_name="router",
@@ -326,22 +537,44 @@ Parameters: {{"param": "value"}}  # 服务参数
             reasoning_steps=["回退路由：未找到匹配的服务"]
         )
     
-    def _update_performance_stats(self, service_name: str, response: MCPResponse, start_time: datetime) -> None:
+    async def _execute_service(self, service: MCPService, request: MCPRequest) -> MCPResponse:
+        """执行单个服务，按本次调用的耗时更新统计（执行失败也计入）"""
+        call_start = time.perf_counter()
+        success = False
+        try:
+            response = await service.execute(request)
+            success = response.success
+            return response
+        finally:
+            self._update_performance_stats(service.name, success, time.perf_counter() - call_start)
+    
+    def _record_request(self, request: MCPRequest, service_name: str) -> None:
+        """记录路由历史"""
+        self.request_history.append(
+            (request.timestamp, request.user_id, request.intent[:_HISTORY_INTENT_MAX], service_name)
+        )
+    
+    def _update_performance_stats(self, service_name: str, success: bool, execution_time: float) -> None:
         """更新性能统计"""
         if service_name not in self.performance_stats:
             return
         
         stats = self.performance_stats[service_name]
-        execution_time = (datetime.now() - start_time).total_seconds()
         
         stats["total_requests"] += 1
-        if response.success:
+        if success:
             stats["successful_requests"] += 1
         
-        # 更新平均响应时间
-        current_avg = stats["average_response_time"]
+        # Welford在线算法更新响应时间的均值和方差（数值稳定，无需保存历史样本）
         total_requests = stats["total_requests"]
-        stats["average_response_time"] = (current_avg * (total_requests - 1) + execution_time) / total_requests
+        mean = stats["average_response_time"]
+        m2 = stats["response_time_variance"] * (total_requests - 1)
+        delta = execution_time - mean
+        mean += delta / total_requests
+        m2 += delta * (execution_time - mean)
+        stats["average_response_time"] = mean
+        stats["response_time_variance"] = m2 / total_requests
+        stats["max_response_time"] = max(stats["max_response_time"], execution_time)
         
         stats["last_used"] = datetime.now()
     
@@ -350,45 +583,49 @@ Parameters: {{"param": "value"}}  # 服务参数
         return self.performance_stats.copy()
     
     async def health_check(self) -> Dict[str, bool]:
-        """服务健康检查"""
-        health_status = {}
+        """服务健康检查（各服务并发探测）"""
+        # 创建测试请求（探测过程不修改请求，所有服务共用）
+        test_request = MCPRequest(
+            user_id="health_check",
+            session_id="health_check",
+            intent="health_check",
+            parameters={},
+            context={}
+        )
         
-        for service_name, service in self.services.items():
+        async def probe(service_name: str, service: MCPService) -> bool:
             try:
-                # 创建测试请求
-                test_request = MCPRequest(
-                    user_id="health_check",
-                    session_id="health_check",
-                    intent="health_check",
-                    parameters={},
-                    context={}
-                )
-                
                 # 检查服务是否能处理请求
-                confidence = await service.can_handle(test_request)
-                health_status[service_name] = confidence > 0.0 and service.enabled
-                
+                confidence = await asyncio.wait_for(
+                    service.can_handle(test_request), timeout=_HEALTH_CHECK_TIMEOUT
+                )
+                return confidence > 0.0 and service.enabled
             except Exception as e:
-                logger.warning(f"⚠️ 服务健康检查失败: {service_name} - {e}")
-                health_status[service_name] = False
+                logger.warning(f"⚠️ 服务健康检查失败: {service_name} - {e!r}")
+                return False
         
-        return health_status
+        names = list(self.services)
+        results = await asyncio.gather(*(probe(name, self.services[name]) for name in names))
+        return dict(zip(names, results))
 
 
 # 全局增强路由器实例（延迟初始化）
 enhanced_mcp_router = None
+_enhanced_router_lock = threading.Lock()
 
 def get_enhanced_router(llm=None, services=None):
-    """获取增强路由器实例"""
+    """获取增强路由器实例（双重检查加锁，并发首次调用只创建一个实例）"""
     global enhanced_mcp_router
     if enhanced_mcp_router is None:
-        # 如果没有提供LLM，使用默认配置
-        if llm is None:
-            from ty_mem_agent.config.settings import get_llm_config
-            from qwen_agent.llm import get_chat_model
-            llm_config = get_llm_config()
-            llm = get_chat_model(llm_config)
-        enhanced_mcp_router = EnhancedMCPRouter(llm=llm, services=services)
+        with _enhanced_router_lock:
+            if enhanced_mcp_router is None:
+                # 如果没有提供LLM，使用默认配置
+                if llm is None:
+                    from ty_mem_agent.config.settings import get_llm_config
+                    from qwen_agent.llm import get_chat_model
+                    llm_config = get_llm_config()
+                    llm = get_chat_model(llm_config)
+                enhanced_mcp_router = EnhancedMCPRouter(llm=llm, services=services)
     return enhanced_mcp_router
 
 
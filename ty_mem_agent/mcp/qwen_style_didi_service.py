@@ -4,28 +4,37 @@ QwenAgent风格的滴滴叫车工具
 完全按照QwenAgent设计理念实现
 """
 
+import itertools
 import os
+import random
+import time
+import zlib
+from functools import lru_cache
 from typing import Dict, Optional, Union
-import requests
 from loguru import logger
 
+from ty_mem_agent.utils import json_utils
+
 # 模拟QwenAgent的BaseTool
 class BaseTool:
     """模拟QwenAgent的BaseTool基类"""
+    
+    # 默认值放在类上，子类定义的同名类属性直接生效，不再逐个复制到实例
+    description = ''
+    parameters = {}
+    file_access = False
+    
     def __init__(self, cfg: Optional[Dict] = None):
         self.cfg = cfg or {}
-        self.name = getattr(self, 'name', self.__class__.__name__.lower())
-        self.description = getattr(self, 'description', '')
-        self.parameters = getattr(self, 'parameters', {})
-        self.file_access = getattr(self, 'file_access', False)
+        if not hasattr(self, 'name'):
+            self.name = self.__class__.__name__.lower()
     
     def _verify_json_format_args(self, params: Union[str, dict]) -> dict:
         """验证JSON格式参数"""
         if isinstance(params, str):
             try:
-                import json
-                return json.loads(params)
-            except:
+                return json_utils.loads(params)
+            except ValueError:
                 return {"destination": params}  # 简单处理
         return params
 
@@ -60,6 +69,33 @@ class QwenStyleDidiService(BaseTool):
         },
         'required': ['destination'],
     }
+    
+    # 模拟的车型配置
+    car_types = {
+        "快车": {"base_price": 8, "per_km": 2.5, "description": "经济实惠"},
+        "专车": {"base_price": 15, "per_km": 3.5, "description": "舒适体验"},
+        "出租车": {"base_price": 10, "per_km": 2.8, "description": "传统出行"}
+    }
+    
+    # 模拟的司机数据（各车型可分配的司机）
+    _DRIVERS = {
+        "快车": (
+            {"name": "张师傅", "rating": 4.8, "plate": "京A12345", "eta": 3},
+            {"name": "李师傅", "rating": 4.9, "plate": "京B67890", "eta": 5},
+            {"name": "王师傅", "rating": 4.7, "plate": "京C11111", "eta": 2},
+        ),
+        "专车": (
+            {"name": "陈师傅", "rating": 4.9, "plate": "京D22222", "eta": 4},
+            {"name": "刘师傅", "rating": 5.0, "plate": "京E33333", "eta": 6},
+        ),
+        "出租车": (
+            {"name": "赵师傅", "rating": 4.6, "plate": "京F44444", "eta": 3},
+            {"name": "孙师傅", "rating": 4.8, "plate": "京G55555", "eta": 4},
+        ),
+    }
+
+    # 订单序号（所有实例共用，保证同一秒内的订单号也不重复）
+    _order_seq = itertools.count(1)
 
     def __init__(self, cfg: Optional[Dict] = None):
         super().__init__(cfg)
@@ -69,12 +105,8 @@ class QwenStyleDidiService(BaseTool):
         if not self.api_key:
             logger.warning("⚠️ 滴滴API密钥未配置，请设置DIDI_API_KEY环境变量")
         
-        # 模拟的车型配置
-        self.car_types = {
-            "快车": {"base_price": 8, "per_km": 2.5, "description": "经济实惠"},
-            "专车": {"base_price": 15, "per_km": 3.5, "description": "舒适体验"},
-            "出租车": {"base_price": 10, "per_km": 2.8, "description": "传统出行"}
-        }
+        # 实例自己的随机数生成器，不与全局random共享状态
+        self._rng = random.Random()
         
         logger.info("✅ 成功创建QwenAgent风格滴滴叫车工具")
 
@@ -94,7 +126,7 @@ class QwenStyleDidiService(BaseTool):
             
             # 模拟叫车流程
             result = self._simulate_ride_booking(destination, origin, car_type)
-            logger.info(f"🚗 叫车服务成功: {result}")
+            logger.info("🚗 叫车服务成功: {}", result)
             return result
             
         except Exception as e:
@@ -107,70 +139,54 @@ class QwenStyleDidiService(BaseTool):
             # 模拟距离计算
             distance = self._estimate_distance(origin, destination)
             
-            # 获取车型信息
-            car_info = self.car_types.get(car_type, self.car_types["快车"])
+            # 获取车型信息（未知车型按快车计算）
+            car_key = car_type if car_type in self.car_types else "快车"
+            car_info = self.car_types[car_key]
             
             # 计算价格
-            price = self._calculate_price(distance, car_info)
+            price = self._calculate_price(distance, car_key)
             
             # 模拟司机匹配
             driver_info = self._match_driver(car_type)
             
-            # 生成订单
-            order_id = f"DIDI{hash(destination + str(distance)) % 10000:04d}"
-            
-            result = f"🚗 叫车成功！\n"
-            result += f"📍 出发地: {origin}\n"
-            result += f"🎯 目的地: {destination}\n"
-            result += f"🚙 车型: {car_type} ({car_info['description']})\n"
-            result += f"📏 距离: {distance:.1f}公里\n"
-            result += f"💰 预估费用: {price:.1f}元\n"
-            result += f"👨‍💼 司机: {driver_info['name']} ({driver_info['rating']}⭐)\n"
-            result += f"🚗 车牌: {driver_info['plate']}\n"
-            result += f"📱 订单号: {order_id}\n"
-            result += f"⏰ 预计到达: {driver_info['eta']}分钟"
+            # 生成订单（时间戳+进程内递增序号，每次预订唯一）
+            order_id = f"DIDI{time.strftime('%Y%m%d%H%M%S')}{next(self._order_seq) % 10000:04d}"
             
-            return result
+            return (
+                f"🚗 叫车成功！\n"
+                f"📍 出发地: {origin}\n"
+                f"🎯 目的地: {destination}\n"
+                f"🚙 车型: {car_type} ({car_info['description']})\n"
+                f"📏 距离: {distance:.1f}公里\n"
+                f"💰 预估费用: {price:.1f}元\n"
+                f"👨‍💼 司机: {driver_info['name']} ({driver_info['rating']}⭐)\n"
+                f"🚗 车牌: {driver_info['plate']}\n"
+                f"📱 订单号: {order_id}\n"
+                f"⏰ 预计到达: {driver_info['eta']}分钟"
+            )
             
         except Exception as e:
             return f"❌ 叫车预订失败: {str(e)}"
     
-    def _estimate_distance(self, origin: str, destination: str) -> float:
-        """估算距离"""
+    @staticmethod
+    @lru_cache(maxsize=1024)
+    def _estimate_distance(origin: str, destination: str) -> float:
+        """估算距离（同一起终点返回相同结果）"""
         # 简单的距离估算（实际应用中应该调用地图API）
-        import random
-        base_distance = 5.0
-        variation = random.uniform(0.5, 3.0)
-        return base_distance + variation
+        # 用起终点的CRC32代替随机数，范围与原来的5.5~8.0公里一致
+        route_hash = zlib.crc32(f"{origin}|{destination}".encode("utf-8"))
+        return 5.5 + ((route_hash & 0xFF) / 255.0) * 2.5
     
-    def _calculate_price(self, distance: float, car_info: Dict) -> float:
+    @staticmethod
+    @lru_cache(maxsize=1024)
+    def _calculate_price(distance: float, car_type: str) -> float:
         """计算价格"""
-        base_price = car_info['base_price']
-        per_km = car_info['per_km']
-        return base_price + (distance * per_km)
+        car_info = QwenStyleDidiService.car_types[car_type]
+        return car_info['base_price'] + (distance * car_info['per_km'])
     
     def _match_driver(self, car_type: str) -> Dict:
         """匹配司机"""
-        import random
-        
-        drivers = {
-            "快车": [
-                {"name": "张师傅", "rating": 4.8, "plate": "京A12345", "eta": 3},
-                {"name": "李师傅", "rating": 4.9, "plate": "京B67890", "eta": 5},
-                {"name": "王师傅", "rating": 4.7, "plate": "京C11111", "eta": 2}
-            ],
-            "专车": [
-                {"name": "陈师傅", "rating": 4.9, "plate": "京D22222", "eta": 4},
-                {"name": "刘师傅", "rating": 5.0, "plate": "京E33333", "eta": 6}
-            ],
-            "出租车": [
-                {"name": "赵师傅", "rating": 4.6, "plate": "京F44444", "eta": 3},
-                {"name": "孙师傅", "rating": 4.8, "plate": "京G55555", "eta": 4}
-            ]
-        }
-        
-        available_drivers = drivers.get(car_type, drivers["快车"])
-        return random.choice(available_drivers)
+        return self._rng.choice(self._DRIVERS.get(car_type, self._DRIVERS["快车"]))
 
 
 if __name__ == "__main__":
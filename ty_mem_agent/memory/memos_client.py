@@ -5,7 +5,8 @@ MemOS记忆系统客户端
 """
 
 import asyncio
-import json
+import hashlib
+from collections import OrderedDict
 from typing import Dict, List, Optional, Any, Union
 from datetime import datetime, timedelta
 import httpx
@@ -13,6 +14,7 @@ from loguru import logger
 
 # 使用简洁的绝对导入
 from ty_mem_agent.config.settings import settings
+from ty_mem_agent.utils import json_utils
 
 
 class MemoryType:
@@ -29,24 +31,36 @@ class MemoryScope:
     SESSION = "session"  # 会话记忆
 
 
+# 连接池配置：复用keep-alive连接，避免每次请求重新握手
+_HTTP_LIMITS = httpx.Limits(max_connections=128, max_keepalive_connections=32, keepalive_expiry=60.0)
+
+
 class MemOSClient:
     """MemOS API客户端"""
     
-    def __init__(self, api_base: str = None, api_key: str = None):
+    def __init__(self, api_base: str = None, api_key: str = None, client: Optional[httpx.AsyncClient] = None):
+        """
+        Args:
+            client: 外部传入的httpx客户端（需已配置base_url和认证头），
+                由调用方负责关闭；不传时创建带连接池的客户端
+        """
         self.api_base = api_base or settings.MEMOS_API_BASE
         self.api_key = api_key or settings.MEMOS_API_KEY
-        self.client = httpx.AsyncClient(
+        self._owns_client = client is None
+        self.client = client or httpx.AsyncClient(
             base_url=self.api_base,
             headers={
                 "Authorization": f"Bearer {self.api_key}",
                 "Content-Type": "application/json"
             },
-            timeout=30.0
+            timeout=30.0,
+            limits=_HTTP_LIMITS
         )
     
     async def close(self):
         """关闭客户端"""
-        await self.client.aclose()
+        if self._owns_client:
+            await self.client.aclose()
     
     async def save_memory(self, 
                          user_id: str,
@@ -59,7 +73,7 @@ class MemOSClient:
         try:
             memory_data = {
                 "user_id": user_id,
-                "content": content if isinstance(content, str) else json.dumps(content),
+                "content": content if isinstance(content, str) else json_utils.dumps(content),
                 "memory_type": memory_type,
                 "scope": scope,
                 "tags": tags or [],
@@ -72,7 +86,7 @@ class MemOSClient:
             response.raise_for_status()
             
             result = response.json()
-            logger.info(f"💾 保存记忆成功: user={user_id}, type={memory_type}, id={result.get('memory_id')}")
+            logger.debug("💾 保存记忆成功: user={}, type={}, id={}", user_id, memory_type, result.get('memory_id'))
             return result
             
         except Exception as e:
@@ -106,7 +120,7 @@ class MemOSClient:
             response.raise_for_status()
             
             memories = response.json().get("memories", [])
-            logger.info(f"🔍 检索记忆: user={user_id}, 找到 {len(memories)} 条记忆")
+            logger.debug("🔍 检索记忆: user={}, 找到 {} 条记忆", user_id, len(memories))
             return memories
             
         except Exception as e:
@@ -120,7 +134,7 @@ class MemOSClient:
             response.raise_for_status()
             
             result = response.json()
-            logger.info(f"🔄 更新记忆成功: id={memory_id}")
+            logger.info("🔄 更新记忆成功: id={}", memory_id)
             return result
             
         except Exception as e:
@@ -133,7 +147,7 @@ class MemOSClient:
             response = await self.client.delete(f"/api/v1/memories/{memory_id}")
             response.raise_for_status()
             
-            logger.info(f"🗑️ 删除记忆成功: id={memory_id}")
+            logger.info("🗑️ 删除记忆成功: id={}", memory_id)
             return True
             
         except Exception as e:
@@ -148,7 +162,7 @@ class MemOSClient:
             response.raise_for_status()
             
             graph = response.json()
-            logger.info(f"🕸️ 获取记忆图谱: user={user_id}, 节点数={len(graph.get('nodes', []))}")
+            logger.info("🕸️ 获取记忆图谱: user={}, 节点数={}", user_id, len(graph.get('nodes', [])))
             return graph
             
         except Exception as e:
@@ -162,18 +176,21 @@ class EnhancedMemoryManager:
     结合MemOS和本地缓存，提供高效的记忆管理
     """
     
-    def __init__(self):
-        self.memos_client = MemOSClient()
-        self.local_cache = {}  # 本地缓存
+    def __init__(self, memos_client: Optional[MemOSClient] = None):
+        self.memos_client = memos_client or MemOSClient()
+        self.local_cache: "OrderedDict[str, Dict]" = OrderedDict()  # 本地LRU缓存
         self.cache_timeout = 300  # 5分钟缓存
+        self.cache_max_size = 512  # 最多缓存条目数
     
     async def close(self):
         """关闭管理器"""
         await self.memos_client.close()
     
     def _get_cache_key(self, user_id: str, context: str) -> str:
-        """生成缓存键"""
-        return f"memory:{user_id}:{hash(context)}"
+        """生成缓存键（查询归一化后取摘要，相同问法命中同一条缓存）"""
+        normalized = " ".join(context.lower().split())
+        digest = hashlib.blake2s(normalized.encode("utf-8"), digest_size=8).hexdigest()
+        return f"memory:{user_id}:{digest}"
     
     def _is_cache_valid(self, cache_entry: Dict) -> bool:
         """检查缓存是否有效"""
@@ -221,46 +238,52 @@ class EnhancedMemoryManager:
         cache_key = self._get_cache_key(user_id, f"{query}:{context}")
         
         # 检查缓存
-        if cache_key in self.local_cache and self._is_cache_valid(self.local_cache[cache_key]):
-            logger.debug(f"📋 使用缓存记忆: {cache_key}")
-            return self.local_cache[cache_key]["data"]
-        
-        # 从MemOS检索
-        memories = []
-        
-        # 1. 检索用户个人记忆
-        user_memories = await self.memos_client.retrieve_memories(
-            user_id=user_id,
-            query=query,
-            scope=MemoryScope.USER,
-            limit=5
-        )
-        memories.extend(user_memories)
+        cache_entry = self.local_cache.get(cache_key)
+        if cache_entry is not None:
+            if self._is_cache_valid(cache_entry):
+                self.local_cache.move_to_end(cache_key)
+                logger.debug("📋 使用缓存记忆: {}", cache_key)
+                return cache_entry["data"]
+            del self.local_cache[cache_key]
         
-        # 2. 检索通用知识
-        general_memories = await self.memos_client.retrieve_memories(
-            user_id="system",
-            query=query,
-            scope=MemoryScope.GENERAL,
-            limit=3
-        )
-        memories.extend(general_memories)
+        # 从MemOS检索（各类记忆相互独立，并发请求）
+        searches = [
+            # 1. 检索用户个人记忆
+            self.memos_client.retrieve_memories(
+                user_id=user_id,
+                query=query,
+                scope=MemoryScope.USER,
+                limit=5
+            ),
+            # 2. 检索通用知识
+            self.memos_client.retrieve_memories(
+                user_id="system",
+                query=query,
+                scope=MemoryScope.GENERAL,
+                limit=3
+            ),
+        ]
         
         # 3. 检索会话记忆
         if context:
-            session_memories = await self.memos_client.retrieve_memories(
+            searches.append(self.memos_client.retrieve_memories(
                 user_id=user_id,
                 query=context,
                 scope=MemoryScope.SESSION,
                 limit=2
-            )
-            memories.extend(session_memories)
+            ))
+        
+        # retrieve_memories 自行处理异常，结果顺序与请求顺序一致
+        memories = [memory for result in await asyncio.gather(*searches) for memory in result]
         
-        # 缓存结果
+        # 缓存结果，超出容量时淘汰最久未使用的条目
         self.local_cache[cache_key] = {
             "data": memories,
             "timestamp": datetime.now().timestamp()
         }
+        self.local_cache.move_to_end(cache_key)
+        while len(self.local_cache) > self.cache_max_size:
+            self.local_cache.popitem(last=False)
         
         return memories
     
@@ -278,18 +301,18 @@ class EnhancedMemoryManager:
             if profile_memories:
                 # 更新现有画像
                 memory_id = profile_memories[0]["memory_id"]
-                current_profile = json.loads(profile_memories[0]["content"])
+                current_profile = json_utils.loads(profile_memories[0]["content"])
                 current_profile.update(new_info)
                 
                 await self.memos_client.update_memory(
                     memory_id,
-                    {"content": json.dumps(current_profile)}
+                    {"content": json_utils.dumps(current_profile)}
                 )
             else:
                 # 创建新画像
                 await self.save_user_profile(user_id, new_info)
                 
-            logger.info(f"🔄 更新用户上下文: user={user_id}")
+            logger.info("🔄 更新用户上下文: user={}", user_id)
             
         except Exception as e:
             logger.error(f"❌ 更新用户上下文失败: {e}")
@@ -305,7 +328,7 @@ class EnhancedMemoryManager:
             )
             
             if memories:
-                return json.loads(memories[0]["content"])
+                return json_utils.loads(memories[0]["content"])
             else:
                 return {}
                 
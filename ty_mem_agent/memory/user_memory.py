@@ -4,17 +4,21 @@
 管理多用户的个性化记忆和会话状态
 """
 
-import json
+import asyncio
 import sqlite3
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Tuple
 from datetime import datetime, timedelta
 from dataclasses import dataclass, asdict
 from loguru import logger
 
+from ty_mem_agent.utils import json_utils
 from .memos_client import memory_manager, MemoryScope, MemoryType
 
+# 构建对话上下文时只需要最近几轮历史
+_CONTEXT_HISTORY_LIMIT = 5
 
-@dataclass
+
+@dataclass(slots=True)
 class UserProfile:
     """用户画像数据类"""
     user_id: str
@@ -39,7 +43,7 @@ class UserProfile:
             self.updated_at = datetime.now()
 
 
-@dataclass
+@dataclass(slots=True)
 class ConversationContext:
     """对话上下文数据类"""
     user_id: str
@@ -106,7 +110,7 @@ class UserMemoryManager:
         """保存用户画像"""
         try:
             profile.updated_at = datetime.now()
-            profile_json = json.dumps(asdict(profile), default=str)
+            profile_json = json_utils.dumps(asdict(profile), default=str)
             
             with sqlite3.connect(self.db_path) as conn:
                 conn.execute("""
@@ -115,7 +119,7 @@ class UserMemoryManager:
                 """, (profile.user_id, profile_json, profile.updated_at))
                 conn.commit()
             
-            logger.info(f"💾 保存用户画像: {profile.user_id}")
+            logger.debug("💾 保存用户画像: {}", profile.user_id)
             return True
             
         except Exception as e:
@@ -126,28 +130,32 @@ class UserMemoryManager:
         """获取用户画像"""
         try:
             with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.execute(
-                    "SELECT profile_data FROM user_profiles WHERE user_id = ?",
-                    (user_id,)
-                )
-                row = cursor.fetchone()
-                
-                if row:
-                    profile_data = json.loads(row[0])
-                    # 处理datetime字段
-                    if 'created_at' in profile_data and isinstance(profile_data['created_at'], str):
-                        profile_data['created_at'] = datetime.fromisoformat(profile_data['created_at'])
-                    if 'updated_at' in profile_data and isinstance(profile_data['updated_at'], str):
-                        profile_data['updated_at'] = datetime.fromisoformat(profile_data['updated_at'])
-                    
-                    return UserProfile(**profile_data)
-                else:
-                    return None
+                return self._query_user_profile(conn, user_id)
                     
         except Exception as e:
             logger.error(f"❌ 获取用户画像失败: {e}")
             return None
     
+    def _query_user_profile(self, conn: sqlite3.Connection, user_id: str) -> Optional[UserProfile]:
+        """在给定连接上读取用户画像"""
+        cursor = conn.execute(
+            "SELECT profile_data FROM user_profiles WHERE user_id = ?",
+            (user_id,)
+        )
+        row = cursor.fetchone()
+        
+        if row:
+            profile_data = json_utils.loads(row[0])
+            # 处理datetime字段
+            if 'created_at' in profile_data and isinstance(profile_data['created_at'], str):
+                profile_data['created_at'] = datetime.fromisoformat(profile_data['created_at'])
+            if 'updated_at' in profile_data and isinstance(profile_data['updated_at'], str):
+                profile_data['updated_at'] = datetime.fromisoformat(profile_data['updated_at'])
+            
+            return UserProfile(**profile_data)
+        else:
+            return None
+    
     def update_user_profile(self, user_id: str, updates: Dict[str, Any]) -> bool:
         """更新用户画像"""
         try:
@@ -171,7 +179,7 @@ class UserMemoryManager:
         """保存对话上下文"""
         try:
             context.last_activity = datetime.now()
-            context_json = json.dumps(asdict(context), default=str)
+            context_json = json_utils.dumps(asdict(context), default=str)
             
             with sqlite3.connect(self.db_path) as conn:
                 conn.execute("""
@@ -181,37 +189,72 @@ class UserMemoryManager:
                 """, (context.session_id, context.user_id, context_json, context.last_activity))
                 conn.commit()
             
-            logger.debug(f"💬 保存对话上下文: {context.session_id}")
+            logger.debug("💬 保存对话上下文: {}", context.session_id)
             return True
             
         except Exception as e:
             logger.error(f"❌ 保存对话上下文失败: {e}")
             return False
     
-    def get_conversation_context(self, session_id: str) -> Optional[ConversationContext]:
-        """获取对话上下文"""
+    def get_conversation_context(self, session_id: str, history_limit: Optional[int] = None) -> Optional[ConversationContext]:
+        """获取对话上下文
+        
+        Args:
+            session_id: 会话ID
+            history_limit: 只返回最近N条对话历史（在SQLite中截取），None表示全部
+        """
         try:
             with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.execute(
-                    "SELECT context_data FROM conversation_contexts WHERE session_id = ?",
-                    (session_id,)
-                )
-                row = cursor.fetchone()
-                
-                if row:
-                    context_data = json.loads(row[0])
-                    # 处理datetime字段
-                    if 'last_activity' in context_data and isinstance(context_data['last_activity'], str):
-                        context_data['last_activity'] = datetime.fromisoformat(context_data['last_activity'])
-                    
-                    return ConversationContext(**context_data)
-                else:
-                    return None
+                return self._query_conversation_context(conn, session_id, history_limit)
                     
         except Exception as e:
             logger.error(f"❌ 获取对话上下文失败: {e}")
             return None
     
+    def _query_conversation_context(self,
+                                    conn: sqlite3.Connection,
+                                    session_id: str,
+                                    history_limit: Optional[int] = None) -> Optional[ConversationContext]:
+        """在给定连接上读取对话上下文"""
+        trim_in_python = False
+        cursor = None
+        if history_limit is not None:
+            try:
+                cursor = conn.execute("""
+                    SELECT json_set(c.context_data, '$.conversation_history', (
+                        SELECT json_group_array(json(t.value)) FROM (
+                            SELECT key, value FROM (
+                                SELECT key, value FROM json_each(c.context_data, '$.conversation_history')
+                                ORDER BY key DESC LIMIT ?
+                            ) ORDER BY key
+                        ) AS t
+                    ))
+                    FROM conversation_contexts AS c WHERE c.session_id = ?
+                """, (history_limit, session_id))
+            except sqlite3.OperationalError as e:
+                # SQLite未启用JSON1扩展时回退到Python端截取
+                logger.debug("SQLite JSON1不可用，在Python中截取对话历史: {}", e)
+                trim_in_python = True
+        if cursor is None:
+            cursor = conn.execute(
+                "SELECT context_data FROM conversation_contexts WHERE session_id = ?",
+                (session_id,)
+            )
+        row = cursor.fetchone()
+        
+        if row:
+            context_data = json_utils.loads(row[0])
+            if trim_in_python:
+                history = context_data.get('conversation_history') or []
+                context_data['conversation_history'] = history[max(len(history) - history_limit, 0):]
+            # 处理datetime字段
+            if 'last_activity' in context_data and isinstance(context_data['last_activity'], str):
+                context_data['last_activity'] = datetime.fromisoformat(context_data['last_activity'])
+            
+            return ConversationContext(**context_data)
+        else:
+            return None
+    
     def cleanup_expired_sessions(self, hours: int = 24) -> int:
         """清理过期会话"""
         try:
@@ -225,7 +268,7 @@ class UserMemoryManager:
                 conn.commit()
                 
                 deleted_count = cursor.rowcount
-                logger.info(f"🧹 清理了 {deleted_count} 个过期会话")
+                logger.info("🧹 清理了 {} 个过期会话", deleted_count)
                 return deleted_count
                 
         except Exception as e:
@@ -235,7 +278,7 @@ class UserMemoryManager:
     def save_memory_insight(self, user_id: str, insight_type: str, insight_data: Dict, confidence: float = 0.5) -> bool:
         """保存记忆洞察"""
         try:
-            insight_json = json.dumps(insight_data)
+            insight_json = json_utils.dumps(insight_data)
             
             with sqlite3.connect(self.db_path) as conn:
                 conn.execute("""
@@ -244,7 +287,7 @@ class UserMemoryManager:
                 """, (user_id, insight_type, insight_json, confidence))
                 conn.commit()
             
-            logger.debug(f"🧠 保存记忆洞察: {user_id} - {insight_type}")
+            logger.debug("🧠 保存记忆洞察: {} - {}", user_id, insight_type)
             return True
             
         except Exception as e:
@@ -255,35 +298,64 @@ class UserMemoryManager:
         """获取记忆洞察"""
         try:
             with sqlite3.connect(self.db_path) as conn:
-                if insight_type:
-                    cursor = conn.execute("""
-                        SELECT insight_type, insight_data, confidence, created_at
-                        FROM memory_insights 
-                        WHERE user_id = ? AND insight_type = ?
-                        ORDER BY created_at DESC LIMIT ?
-                    """, (user_id, insight_type, limit))
-                else:
-                    cursor = conn.execute("""
-                        SELECT insight_type, insight_data, confidence, created_at
-                        FROM memory_insights 
-                        WHERE user_id = ?
-                        ORDER BY created_at DESC LIMIT ?
-                    """, (user_id, limit))
-                
-                insights = []
-                for row in cursor.fetchall():
-                    insights.append({
-                        "type": row[0],
-                        "data": json.loads(row[1]),
-                        "confidence": row[2],
-                        "created_at": row[3]
-                    })
-                
-                return insights
+                return self._query_memory_insights(conn, user_id, insight_type, limit)
                 
         except Exception as e:
             logger.error(f"❌ 获取记忆洞察失败: {e}")
             return []
+    
+    def _query_memory_insights(self,
+                               conn: sqlite3.Connection,
+                               user_id: str,
+                               insight_type: str = None,
+                               limit: int = 10) -> List[Dict]:
+        """在给定连接上读取记忆洞察"""
+        if insight_type:
+            cursor = conn.execute("""
+                SELECT insight_type, insight_data, confidence, created_at
+                FROM memory_insights 
+                WHERE user_id = ? AND insight_type = ?
+                ORDER BY created_at DESC LIMIT ?
+            """, (user_id, insight_type, limit))
+        else:
+            cursor = conn.execute("""
+                SELECT insight_type, insight_data, confidence, created_at
+                FROM memory_insights 
+                WHERE user_id = ?
+                ORDER BY created_at DESC LIMIT ?
+            """, (user_id, limit))
+        
+        insights = []
+        for row in cursor.fetchall():
+            insights.append({
+                "type": row[0],
+                "data": json_utils.loads(row[1]),
+                "confidence": row[2],
+                "created_at": row[3]
+            })
+        
+        return insights
+    
+    def get_context_snapshot(self,
+                             user_id: str,
+                             session_id: str,
+                             history_limit: Optional[int] = None,
+                             insight_limit: int = 10
+                             ) -> Tuple[Optional[UserProfile], Optional[ConversationContext], List[Dict]]:
+        """一次性读取用户画像、对话上下文和记忆洞察
+        
+        三个查询共用一个连接和一个读事务，避免分别建立连接。
+        """
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                profile = self._query_user_profile(conn, user_id)
+                conv_context = self._query_conversation_context(conn, session_id, history_limit)
+                insights = self._query_memory_insights(conn, user_id, None, insight_limit)
+                return profile, conv_context, insights
+                
+        except Exception as e:
+            logger.error(f"❌ 获取用户上下文快照失败: {e}")
+            return None, None, []
 
 
 class IntegratedMemorySystem:
@@ -314,7 +386,7 @@ class IntegratedMemorySystem:
             # 同步到远程MemOS
             await self.remote_memory.save_user_profile(user_id, asdict(profile))
             
-            logger.info(f"👤 初始化新用户: {user_id}")
+            logger.info("👤 初始化新用户: {}", user_id)
         
         return profile
     
@@ -336,7 +408,7 @@ class IntegratedMemorySystem:
                     confidence=0.9
                 )
                 
-                logger.info(f"🔄 更新用户信息: {user_id}")
+                logger.info("🔄 更新用户信息: {}", user_id)
                 return True
             
             return False
@@ -346,66 +418,91 @@ class IntegratedMemorySystem:
             return False
     
     async def save_conversation(self, user_id: str, session_id: str, message: str, 
-                               response: str, context: Dict = None) -> bool:
-        """保存对话记录"""
+                               response: str, context: Dict = None, preferences: Dict = None) -> bool:
+        """保存对话记录
+        
+        Args:
+            preferences: 本轮分析出的用户偏好，与对话上下文一起写入本地数据库
+        """
         try:
-            # 保存到远程MemOS
+            # 远程MemOS写入与本地SQLite写入并发执行
             conversation_text = f"用户: {message}\n助手: {response}"
-            await self.remote_memory.save_conversation_memory(user_id, conversation_text, context)
-            
-            # 更新本地上下文
-            conv_context = self.user_manager.get_conversation_context(session_id)
-            if not conv_context:
-                conv_context = ConversationContext(user_id=user_id, session_id=session_id)
-            
-            # 更新对话历史（保留最近10条）
-            conv_context.conversation_history.append({
-                "message": message,
-                "response": response,
-                "timestamp": datetime.now().isoformat(),
-                "context": context
-            })
-            
-            if len(conv_context.conversation_history) > 10:
-                conv_context.conversation_history = conv_context.conversation_history[-10:]
-            
-            # 分析和更新上下文
-            if context:
-                if context.get("topic"):
-                    conv_context.current_topic = context["topic"]
-                if context.get("entities"):
-                    conv_context.mentioned_entities.extend(context["entities"])
-                    # 去重并保留最近的
-                    conv_context.mentioned_entities = list(set(conv_context.mentioned_entities))[-20:]
-            
-            self.user_manager.save_conversation_context(conv_context)
+            await asyncio.gather(
+                self.remote_memory.save_conversation_memory(user_id, conversation_text, context),
+                asyncio.to_thread(self._save_conversation_local, user_id, session_id,
+                                  message, response, context, preferences),
+            )
             
-            logger.debug(f"💬 保存对话: {user_id} - {session_id}")
+            logger.debug("💬 保存对话: {} - {}", user_id, session_id)
             return True
             
         except Exception as e:
             logger.error(f"❌ 保存对话失败: {e}")
             return False
     
-    async def get_user_context(self, user_id: str, session_id: str) -> Dict:
-        """获取用户完整上下文"""
-        try:
-            # 获取用户画像
+    def _save_conversation_local(self, user_id: str, session_id: str, message: str,
+                                 response: str, context: Optional[Dict], preferences: Optional[Dict]) -> None:
+        """更新本地对话上下文和用户偏好"""
+        conv_context = self.user_manager.get_conversation_context(session_id)
+        if not conv_context:
+            conv_context = ConversationContext(user_id=user_id, session_id=session_id)
+        
+        # 更新对话历史（保留最近10条）
+        conv_context.conversation_history.append({
+            "message": message,
+            "response": response,
+            "timestamp": datetime.now().isoformat(),
+            "context": context
+        })
+        
+        if len(conv_context.conversation_history) > 10:
+            conv_context.conversation_history = conv_context.conversation_history[-10:]
+        
+        # 分析和更新上下文
+        if context:
+            if context.get("topic"):
+                conv_context.current_topic = context["topic"]
+            if context.get("entities"):
+                conv_context.mentioned_entities.extend(context["entities"])
+                # 去重并保留最近的
+                conv_context.mentioned_entities = list(set(conv_context.mentioned_entities))[-20:]
+        
+        self.user_manager.save_conversation_context(conv_context)
+        
+        # 更新用户偏好
+        if preferences:
             profile = self.user_manager.get_user_profile(user_id)
+            if not profile:
+                profile = UserProfile(user_id=user_id)
+            profile.preferences.update(preferences)
+            self.user_manager.save_user_profile(profile)
+    
+    async def get_user_context(self, user_id: str, session_id: str, query: str = "") -> Dict:
+        """获取用户完整上下文
+        
+        本地SQLite数据（画像、最近对话、洞察）通过一个连接一次读取；
+        远程记忆检索依赖对话话题，在本地读取完成后发起。
+        """
+        try:
+            profile, conv_context, insights = await asyncio.to_thread(
+                self.user_manager.get_context_snapshot,
+                user_id, session_id, _CONTEXT_HISTORY_LIMIT, 5
+            )
             
-            # 获取对话上下文
-            conv_context = self.user_manager.get_conversation_context(session_id)
+            # 组合查询：用户输入 + 当前话题
+            query_parts = [query] if query else []
+            topic = conv_context.current_topic if conv_context else None
+            # 话题比查询长时不可能是其子串，跳过子串扫描
+            if topic and (len(topic) > len(query) or topic not in query):
+                query_parts.append(topic)
             
             # 获取相关记忆
             recent_memories = await self.remote_memory.get_relevant_memories(
                 user_id, 
-                conv_context.current_topic if conv_context else "",
+                " ".join(query_parts),
                 context=""
             )
             
-            # 获取记忆洞察
-            insights = self.user_manager.get_memory_insights(user_id, limit=5)
-            
             context = {
                 "user_profile": asdict(profile) if profile else {},
                 "conversation_context": asdict(conv_context) if conv_context else {},
@@ -451,7 +548,7 @@ class IntegratedMemorySystem:
                 confidence=0.7
             )
             
-            logger.info(f"📊 分析用户模式: {user_id}")
+            logger.info("📊 分析用户模式: {}", user_id)
             return patterns
             
         except Exception as e:
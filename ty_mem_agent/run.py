@@ -8,19 +8,12 @@ import sys
 import asyncio
 from pathlib import Path
 
-# 添加项目路径
+# 添加项目路径（ty_mem_agent的上级目录，使包内绝对导入可用）
 project_root = Path(__file__).parent
-sys.path.insert(0, str(project_root))
+sys.path.insert(0, str(project_root.parent))
 
 # 初始化日志系统
-try:
-    from utils.logger_config import setup_logger, get_logger
-except ImportError:
-    # 如果在ty_mem_agent目录内运行，调整导入路径
-    import sys
-    from pathlib import Path
-    sys.path.append(str(Path(__file__).parent))
-    from utils.logger_config import setup_logger, get_logger
+from ty_mem_agent.utils.logger_config import setup_logger, get_logger
 
 # 设置日志
 log_level = os.getenv('LOG_LEVEL', 'INFO')
@@ -127,7 +120,7 @@ async def main():
     
     # 导入并启动应用
     try:
-        from main import TYMemoryAgentApp
+        from ty_mem_agent.main import TYMemoryAgentApp
         
         app = TYMemoryAgentApp()
         success = await app.run()
@@ -5,7 +5,6 @@
 """
 
 import asyncio
-import json
 from typing import Dict, List, Optional, Any
 from datetime import datetime
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Depends, status
@@ -17,7 +16,8 @@ from loguru import logger
 
 # 使用简洁的绝对导入
 from ty_mem_agent.config.settings import settings
-from ty_mem_agent.agents.ty_memory_agent import TYMemoryAgent
+from ty_mem_agent.utils import json_utils
+from ty_mem_agent.agents.ty_memory_agent import TYMemoryAgent, warmup_default_llm, warmup_default_tools
 from ty_mem_agent.memory.user_memory import integrated_memory
 from ty_mem_agent.server.user_manager import user_manager, init_default_users
 from qwen_agent.llm.schema import Message, USER, ASSISTANT
@@ -97,17 +97,35 @@ class ChatServer:
         self.active_connections: Dict[str, WebSocket] = {}
         self.user_agents: Dict[str, TYMemoryAgent] = {}
         
-        # 初始化路由
-        self._setup_routes()
+        # uvicorn服务器实例（start_server时创建）；服务器创建前收到的退出请求先记录下来
+        self._uvicorn_server = None
+        self._exit_requested = False
         
-        # 初始化默认用户
-        init_default_users()
+        # 初始化路由（默认用户在启动事件中初始化）
+        self._setup_routes()
         
         logger.info("🚀 Chat Server 初始化完成")
     
     def _setup_routes(self):
         """设置路由"""
         
+        @self.app.on_event("startup")
+        async def startup():
+            """预热默认工具和LLM并初始化默认用户（三者相互独立，并发执行）
+            
+            工具和LLM预热避免首个连接创建Agent时阻塞；默认用户的密码哈希
+            计算较慢，放到线程池中与预热同时进行。
+            """
+            results = await asyncio.gather(
+                warmup_default_tools(),
+                warmup_default_llm(),
+                asyncio.to_thread(init_default_users),
+                return_exceptions=True
+            )
+            for task_name, result in zip(("默认工具预热", "默认LLM预热", "默认用户初始化"), results):
+                if isinstance(result, Exception):
+                    logger.error(f"❌ {task_name}失败: {result}")
+        
         @self.app.get("/")
         async def root():
             """首页"""
@@ -227,18 +245,17 @@ class ChatServer:
         user_id = user.user_id
         self.active_connections[user_id] = websocket
         
-        # 创建或获取用户的Agent
-        if user_id not in self.user_agents:
-            agent = TYMemoryAgent()
-            session = user_manager.get_user_session(user_id)
-            session_id = session.session_id if session else f"ws_{datetime.now().strftime('%Y%m%d%H%M%S')}"
-            
-            await agent.set_user_context(user_id, session_id)
-            self.user_agents[user_id] = agent
-        
-        logger.info(f"🔗 用户连接: {user.username} ({user_id})")
+        # 本次连接使用的会话ID（优先使用登录时创建的会话）
+        session = user_manager.get_user_session(user_id)
+        session_id = session.session_id if session else f"ws_{datetime.now().strftime('%Y%m%d%H%M%S')}"
         
         try:
+            # 创建或获取用户的Agent（构造时会创建LLM客户端、加载工具，放到线程池中避免阻塞事件循环）
+            if user_id not in self.user_agents:
+                self.user_agents[user_id] = await asyncio.to_thread(TYMemoryAgent)
+            
+            logger.info("🔗 用户连接: {} ({})", user.username, user_id)
+            
             # 发送欢迎消息
             await self._send_welcome_message(websocket, user)
             
@@ -246,13 +263,13 @@ class ChatServer:
             while True:
                 # 接收消息
                 data = await websocket.receive_text()
-                message_data = json.loads(data)
+                message_data = json_utils.loads(data)
                 
                 # 处理聊天消息
-                await self._handle_chat_message(websocket, user_id, message_data)
+                await self._handle_chat_message(websocket, user_id, session_id, message_data)
                 
         except WebSocketDisconnect:
-            logger.info(f"🔌 用户断开连接: {user.username}")
+            logger.info("🔌 用户断开连接: {}", user.username)
         except Exception as e:
             logger.error(f"❌ WebSocket错误: {e}")
         finally:
@@ -290,43 +307,46 @@ class ChatServer:
                 "metadata": {"type": "welcome", "memory_summary": memory_summary}
             }
             
-            await websocket.send_text(json.dumps(response))
+            await websocket.send_text(json_utils.dumps(response))
             
         except Exception as e:
             logger.error(f"❌ 发送欢迎消息失败: {e}")
     
-    async def _handle_chat_message(self, websocket: WebSocket, user_id: str, message_data: Dict):
+    async def _handle_chat_message(self, websocket: WebSocket, user_id: str, session_id: str, message_data: Dict):
         """处理聊天消息"""
         try:
             content = message_data.get("content", "")
             if not content.strip():
                 return
             
-            # 发送正在处理消息
-            await websocket.send_text(json.dumps({
-                "type": "status",
-                "content": "正在思考...",
-                "timestamp": datetime.now().isoformat()
-            }))
-            
             # 获取用户的Agent
             agent = self.user_agents.get(user_id)
             if not agent:
-                await websocket.send_text(json.dumps({
+                await websocket.send_text(json_utils.dumps({
                     "type": "error",
                     "content": "Agent未初始化，请重新连接",
                     "timestamp": datetime.now().isoformat()
                 }))
                 return
             
-            # 创建消息对象
+            # 创建消息对象，并在发送状态消息的同时开始获取用户记忆
             user_message = Message(role=USER, content=content)
+            memory_task = agent.prefetch_memory([user_message], user_id=user_id, session_id=session_id)
+            
+            # 发送正在处理消息
+            await websocket.send_text(json_utils.dumps({
+                "type": "status",
+                "content": "正在思考...",
+                "timestamp": datetime.now().isoformat()
+            }))
             
             # 处理消息并流式返回
             response_content = ""
             message_id = f"msg_{datetime.now().strftime('%Y%m%d%H%M%S%f')}"
             
-            async for response in agent._run([user_message], user_id=user_id, session_id=agent.current_session_id):
+            async for response in agent.run_with_memory([user_message], user_id=user_id,
+                                                        session_id=session_id,
+                                                        memory_task=memory_task):
                 if response and response[-1]:
                     assistant_message = response[-1]
                     new_content = assistant_message.content
@@ -335,7 +355,7 @@ class ChatServer:
                     if new_content != response_content:
                         response_content = new_content
                         
-                        await websocket.send_text(json.dumps({
+                        await websocket.send_text(json_utils.dumps({
                             "type": "message",
                             "content": response_content,
                             "timestamp": datetime.now().isoformat(),
@@ -347,7 +367,7 @@ class ChatServer:
                         }))
             
             # 发送完成状态
-            await websocket.send_text(json.dumps({
+            await websocket.send_text(json_utils.dumps({
                 "type": "status",
                 "content": "完成",
                 "timestamp": datetime.now().isoformat(),
@@ -356,7 +376,7 @@ class ChatServer:
             
         except Exception as e:
             logger.error(f"❌ 处理聊天消息失败: {e}")
-            await websocket.send_text(json.dumps({
+            await websocket.send_text(json_utils.dumps({
                 "type": "error",
                 "content": f"处理消息时出错：{str(e)}",
                 "timestamp": datetime.now().isoformat()
@@ -365,17 +385,13 @@ class ChatServer:
     async def _get_user_memory_summary(self, user_id: str) -> Dict:
         """获取用户记忆摘要"""
         try:
-            agent = self.user_agents.get(user_id)
-            if agent:
-                return await agent.get_user_summary(user_id)
-            else:
-                # 直接从集成记忆系统获取
-                context = await integrated_memory.get_user_context(user_id, "summary")
-                return {
-                    "user_profile": context.get("user_profile", {}),
-                    "memory_count": len(context.get("relevant_memories", [])),
-                    "insights_count": len(context.get("insights", []))
-                }
+            # 从集成记忆系统获取
+            context = await integrated_memory.get_user_context(user_id, "summary")
+            return {
+                "user_profile": context.get("user_profile", {}),
+                "memory_count": len(context.get("relevant_memories", [])),
+                "insights_count": len(context.get("insights", []))
+            }
         except Exception as e:
             logger.error(f"❌ 获取用户记忆摘要失败: {e}")
             return {}
@@ -387,13 +403,12 @@ class ChatServer:
             if user_id in self.active_connections:
                 del self.active_connections[user_id]
             
-            # 清理Agent
-            if user_id in self.user_agents:
-                agent = self.user_agents[user_id]
-                await agent.cleanup()
-                del self.user_agents[user_id]
+            # 清理Agent（等待本连接的记忆写入完成）
+            agent = self.user_agents.pop(user_id, None)
+            if agent is not None:
+                await agent.close()
             
-            logger.info(f"🔌 用户断开: {user_id}")
+            logger.info("🔌 用户断开: {}", user_id)
             
         except Exception as e:
             logger.error(f"❌ 断开用户连接失败: {e}")
@@ -564,6 +579,10 @@ class ChatServer:
     
     async def start_server(self):
         """启动服务器"""
+        if self._exit_requested:
+            logger.info("🛑 启动前已收到退出请求，不再启动Chat Server")
+            return
+        
         import uvicorn
         
         logger.info(f"🚀 启动Chat Server: {settings.HOST}:{settings.PORT}")
@@ -576,8 +595,14 @@ class ChatServer:
             reload=settings.DEBUG
         )
         
-        server = uvicorn.Server(config)
-        await server.serve()
+        self._uvicorn_server = uvicorn.Server(config)
+        await self._uvicorn_server.serve()
+    
+    def stop_server(self):
+        """通知服务器优雅退出（start_server随后返回；服务器尚未创建时start_server直接返回）"""
+        self._exit_requested = True
+        if self._uvicorn_server is not None:
+            self._uvicorn_server.should_exit = True
     
     async def cleanup(self):
         """清理资源"""
@@ -8,7 +8,7 @@ import jwt
 import hashlib
 import secrets
 from typing import Dict, Optional, List
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from dataclasses import dataclass, asdict
 from passlib.context import CryptContext
 from loguru import logger
@@ -86,7 +86,7 @@ class UserManager:
             )
             
             self.users[user_id] = user
-            logger.info(f"👤 创建用户: {username} ({user_id})")
+            logger.info("👤 创建用户: {} ({})", username, user_id)
             return user
             
         except Exception as e:
@@ -114,7 +114,7 @@ class UserManager:
             
             # 更新最后登录时间
             user.last_login = datetime.now()
-            logger.info(f"🔐 用户认证成功: {username}")
+            logger.info("🔐 用户认证成功: {}", username)
             return user
             
         except Exception as e:
@@ -143,7 +143,7 @@ class UserManager:
             self.sessions[session_id] = session
             self.active_sessions[user_id] = session_id
             
-            logger.info(f"📱 创建会话: {user_id} - {session_id}")
+            logger.info("📱 创建会话: {} - {}", user_id, session_id)
             return session
             
         except Exception as e:
@@ -155,7 +155,7 @@ class UserManager:
         session = self.sessions.get(session_id)
         if session and session.is_active:
             # 检查会话是否过期
-            timeout = timedelta(minutes=settings.CHAT_CONFIG.get("session_timeout_minutes", 60))
+            timeout = timedelta(minutes=settings.CHAT_CONFIG.session_timeout_minutes)
             if datetime.now() - session.last_activity > timeout:
                 self.end_session(session_id)
                 return None
@@ -185,7 +185,7 @@ class UserManager:
                     if self.active_sessions[session.user_id] == session_id:
                         del self.active_sessions[session.user_id]
                 
-                logger.info(f"📱 结束会话: {session_id}")
+                logger.info("📱 结束会话: {}", session_id)
                 return True
             
             return False
@@ -197,7 +197,6 @@ class UserManager:
     def create_access_token(self, user_id: str) -> str:
         """创建访问令牌"""
         # 使用UTC时间避免时区问题
-        from datetime import timezone
         now = datetime.now(timezone.utc)
         expire = now + timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
         to_encode = {
@@ -257,7 +256,7 @@ class UserManager:
                 if field in allowed_fields and hasattr(user, field):
                     setattr(user, field, value)
             
-            logger.info(f"👤 更新用户: {user_id}")
+            logger.info("👤 更新用户: {}", user_id)
             return True
             
         except Exception as e:
@@ -271,34 +270,45 @@ class UserManager:
     def get_user_stats(self) -> Dict:
         """获取用户统计信息"""
         total_users = len(self.users)
-        active_users = len([u for u in self.users.values() if u.is_active])
-        active_sessions = len([s for s in self.sessions.values() if s.is_active])
+        active_users = sum(1 for u in self.users.values() if u.is_active)
+        active_sessions = sum(1 for s in self.sessions.values() if s.is_active)
+        today = datetime.now().date()
         
         return {
             "total_users": total_users,
             "active_users": active_users,
             "active_sessions": active_sessions,
-            "registered_today": len([
-                u for u in self.users.values() 
-                if u.created_at and u.created_at.date() == datetime.now().date()
-            ])
+            "registered_today": sum(
+                1 for u in self.users.values()
+                if u.created_at and u.created_at.date() == today
+            )
         }
     
     def cleanup_expired_sessions(self) -> int:
         """清理过期会话"""
         try:
-            timeout = timedelta(minutes=settings.CHAT_CONFIG.get("session_timeout_minutes", 60))
+            timeout = timedelta(minutes=settings.CHAT_CONFIG.session_timeout_minutes)
             cutoff_time = datetime.now() - timeout
             
-            expired_sessions = []
+            # 一次遍历拆分出过期会话，整体替换会话表，不再逐个调用end_session
+            kept_sessions: Dict[str, Session] = {}
+            expired_sessions: List[Session] = []
             for session_id, session in self.sessions.items():
                 if session.last_activity < cutoff_time:
-                    expired_sessions.append(session_id)
+                    expired_sessions.append(session)
+                else:
+                    kept_sessions[session_id] = session
             
-            for session_id in expired_sessions:
-                self.end_session(session_id)
+            if not expired_sessions:
+                return 0
+            
+            self.sessions = kept_sessions
+            for session in expired_sessions:
+                session.is_active = False
+                if self.active_sessions.get(session.user_id) == session.session_id:
+                    del self.active_sessions[session.user_id]
             
-            logger.info(f"🧹 清理过期会话: {len(expired_sessions)} 个")
+            logger.info("🧹 清理过期会话: {} 个", len(expired_sessions))
             return len(expired_sessions)
             
         except Exception as e:
@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+"""
+JSON序列化工具
+安装了orjson时使用orjson，否则回退到标准库json
+"""
+
+import json
+from typing import Any, Callable, Optional
+
+try:
+    import orjson
+except ImportError:  # orjson为可选依赖
+    orjson = None
+
+
+def dumps(obj: Any, sort_keys: bool = False, default: Optional[Callable[[Any], Any]] = None) -> str:
+    """序列化为紧凑的JSON字符串（非ASCII字符不转义）"""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=default, option=option).decode("utf-8")
+    return json.dumps(obj, sort_keys=sort_keys, default=default, ensure_ascii=False, separators=(",", ":"))
+
+
+def loads(data: Any) -> Any:
+    """反序列化JSON字符串或字节"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
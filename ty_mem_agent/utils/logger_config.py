@@ -4,8 +4,11 @@
 提供项目级别的日志配置和管理
 """
 
+import functools
 import sys
 import os
+import threading
+import time
 from pathlib import Path
 from typing import Optional
 from loguru import logger
@@ -16,6 +19,7 @@ class LoggerConfig:
     
     _initialized = False
     _loggers = {}
+    _lock = threading.Lock()
     
     @classmethod
     def setup_logger(cls, 
@@ -24,7 +28,9 @@ class LoggerConfig:
                     log_file: Optional[str] = None,
                     rotation: str = "10 MB",
                     retention: str = "7 days",
-                    format_string: Optional[str] = None) -> None:
+                    format_string: Optional[str] = None,
+                    enqueue: bool = False,
+                    force: bool = False) -> None:
         """
         设置全局日志配置
         
@@ -35,57 +41,63 @@ class LoggerConfig:
             rotation: 日志轮转大小
             retention: 日志保留时间
             format_string: 自定义格式字符串
+            enqueue: 日志写入放到后台线程，调用方不等待磁盘I/O
+            force: 已初始化时也重新配置（应用入口使用）
         """
-        if cls._initialized:
-            return
+        # 加锁并在锁内再次检查，并发调用时只初始化一次
+        with cls._lock:
+            if cls._initialized and not force:
+                return
             
-        # 移除默认处理器
-        logger.remove()
-        
-        # 控制台日志格式
-        console_format = (
-            "<green>{time:MM-DD HH:mm:ss}</green> | "
-            "<level>{level: <8}</level> | "
-            "<cyan>{name}</cyan> | "
-            "<level>{message}</level>"
-        )
-        
-        if format_string:
-            console_format = format_string
-        
-        # 添加控制台处理器
-        logger.add(
-            sys.stdout,
-            level=level,
-            format=console_format,
-            colorize=True,
-            filter=lambda record: record["level"].name != "TRACE"
-        )
-        
-        # 添加文件处理器（如果指定了文件路径）
-        if log_file:
-            log_path = Path(log_file)
-            log_path.parent.mkdir(parents=True, exist_ok=True)
+            # 移除默认处理器
+            logger.remove()
             
-            file_format = (
-                "{time:YYYY-MM-DD HH:mm:ss.SSS} | "
-                "{level: <8} | "
-                "{name}:{function}:{line} | "
-                "{message}"
+            # 控制台日志格式
+            console_format = (
+                "<green>{time:MM-DD HH:mm:ss}</green> | "
+                "<level>{level: <8}</level> | "
+                "<cyan>{name}</cyan> | "
+                "<level>{message}</level>"
             )
             
+            if format_string:
+                console_format = format_string
+            
+            # 添加控制台处理器
             logger.add(
-                log_file,
+                sys.stdout,
                 level=level,
-                format=file_format,
-                rotation=rotation,
-                retention=retention,
-                compression="zip",
-                encoding="utf-8"
+                format=console_format,
+                colorize=True,
+                filter=lambda record: record["level"].name != "TRACE",
+                enqueue=enqueue
             )
-        
-        cls._initialized = True
-        logger.info(f"📋 日志系统初始化完成 - Level: {level}")
+            
+            # 添加文件处理器（如果指定了文件路径）
+            if log_file:
+                log_path = Path(log_file)
+                log_path.parent.mkdir(parents=True, exist_ok=True)
+            
+                file_format = (
+                    "{time:YYYY-MM-DD HH:mm:ss.SSS} | "
+                    "{level: <8} | "
+                    "{name}:{function}:{line} | "
+                    "{message}"
+                )
+            
+                logger.add(
+                    log_file,
+                    level=level,
+                    format=file_format,
+                    rotation=rotation,
+                    retention=retention,
+                    compression="zip",
+                    encoding="utf-8",
+                    enqueue=enqueue
+                )
+            
+            cls._initialized = True
+            logger.info(f"📋 日志系统初始化完成 - Level: {level}")
     
     @classmethod
     def get_logger(cls, name: str = None) -> "logger":
@@ -187,9 +199,6 @@ def get_config_logger():
 def log_execution_time(func_name: str = None):
     """记录函数执行时间的装饰器"""
     def decorator(func):
-        import time
-        import functools
-        
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
             name = func_name or f"{func.__module__}.{func.__name__}"
@@ -212,9 +221,6 @@ def log_execution_time(func_name: str = None):
 def log_async_execution_time(func_name: str = None):
     """记录异步函数执行时间的装饰器"""
     def decorator(func):
-        import time
-        import functools
-        
         @functools.wraps(func)
         async def wrapper(*args, **kwargs):
             name = func_name or f"{func.__module__}.{func.__name__}"
@@ -244,12 +250,12 @@ class LogContext:
         self.start_time = None
     
     def __enter__(self):
-        self.start_time = __import__('time').time()
+        self.start_time = time.time()
         self.logger.info(f"🚀 开始: {self.operation}")
         return self
     
     def __exit__(self, exc_type, exc_val, exc_tb):
-        execution_time = __import__('time').time() - self.start_time
+        execution_time = time.time() - self.start_time
         
         if exc_type is None:
             self.logger.info(f"✅ 完成: {self.operation} ({execution_time:.3f}s)")